@@ -0,0 +1,173 @@
+"""
+Benchmark of genesis generation over a matrix of node counts, client counts
+and fresh/append modes.
+
+Every case runs in its own process against a temporary chroot, so it needs
+neither network access nor the real /var/lib/indy, and its peak RSS is not
+mixed with the other cases. Results are appended as JSON lines to a results
+file, labelled with the version under test, so runs can be compared.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import tempfile
+import time
+
+from indy_common.config_util import getConfig
+from indy_common.config_helper import ConfigHelper, NodeConfigHelper
+from indy_common.txn_util import getTxnOrderedFields
+
+from indy_network import NetworkSetup, GENESIS_MANIFEST_FILE
+from phase_timer import PhaseTimer
+
+portsStart = 9700
+nodeParamsFileName = 'indy.env'
+
+
+def comma_separated_ints(arg):
+    try:
+        return [int(x) for x in arg.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{}' is not a comma separated list of numbers".format(arg))
+
+
+def read_args():
+    parser = argparse.ArgumentParser(description="Benchmark genesis generation")
+    parser.add_argument('--nodes', type=comma_separated_ints, default=[4, 25, 100, 1000],
+                        help="node counts (default 4,25,100,1000)")
+    parser.add_argument('--clients', type=comma_separated_ints, default=[0, 1000, 100000, 1000000],
+                        help="client counts (default 0,1000,100000,1000000)")
+    parser.add_argument('--modes', type=lambda arg: arg.split(','), default=['fresh', 'append'],
+                        help="fresh, append or both (default fresh,append)")
+    parser.add_argument('--workers', type=NetworkSetup._bootstrap_args_type_workers, default=1,
+                        help="worker processes for key derivation, 0 means one per CPU (default 1)")
+    parser.add_argument('--results', type=str, default='genesis_benchmark.jsonl',
+                        help="JSON lines file the results are appended to")
+    parser.add_argument('--label', type=str,
+                        help="version label of this run (git describe by default)")
+    parser.add_argument('--compare', type=str,
+                        help="label of a previous run to compare with")
+    return parser.parse_args()
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def genesis_txn_count(genesis_dir):
+    manifest_path = os.path.join(genesis_dir, GENESIS_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return 0
+    with open(manifest_path) as f:
+        return sum(entry['txn_count'] for entry in json.load(f).values())
+
+
+def generate(config, chroot, node_count, client_count, append, workers, timer):
+    with timer.phase('key_derivation'):
+        steward_defs, node_defs = NetworkSetup.gen_defs(None, None, None, node_count, portsStart, workers)
+        client_defs = NetworkSetup.iter_client_defs(client_count, workers)
+        trustee_def = NetworkSetup.gen_trustee_def(None, workers)
+    NetworkSetup.bootstrap_nodes_core(config, config.NETWORK_NAME, append, getTxnOrderedFields(), trustee_def,
+                                      steward_defs, node_defs, client_defs, None, nodeParamsFileName,
+                                      ConfigHelper, NodeConfigHelper, chroot=chroot,
+                                      workers=workers, timer=timer)
+
+
+def run_case(node_count, client_count, mode, workers, results):
+    logging.getLogger().disabled = True
+    with tempfile.TemporaryDirectory(prefix='genesis-bench-') as chroot:
+        config = getConfig()
+        config.NETWORK_NAME = 'bench'
+        config.GENERAL_CONFIG_DIR = os.path.join(chroot, 'etc')
+        genesis_dir = ConfigHelper(config, chroot=chroot).genesis_dir
+
+        append = mode == 'append'
+        if append:
+            # Start from a genesis holding half of the clients and append the other half
+            generate(config, chroot, node_count, client_count // 2, False, workers, PhaseTimer())
+        txns_before = genesis_txn_count(genesis_dir)
+
+        timer = PhaseTimer()
+        started = time.perf_counter()
+        generate(config, chroot, node_count, client_count, append, workers, timer)
+        wall_time = time.perf_counter() - started
+
+        txns = genesis_txn_count(genesis_dir) - txns_before
+        report = timer.report()
+        results.put({
+            'nodes': node_count,
+            'clients': client_count,
+            'mode': mode,
+            'workers': workers,
+            'txns': txns,
+            'wall_time': wall_time,
+            'txns_per_sec': txns / wall_time if wall_time else None,
+            'peak_rss_kb': report['peak_rss_kb'],
+            'phases': report['phases'],
+        })
+
+
+def load_results(results_path, label):
+    if not os.path.exists(results_path):
+        return {}
+    previous = {}
+    with open(results_path) as f:
+        for line in f:
+            result = json.loads(line)
+            if result['label'] == label:
+                previous[(result['nodes'], result['clients'], result['mode'])] = result
+    return previous
+
+
+def print_result(result, baseline=None):
+    line = "nodes={:<5} clients={:<8} mode={:<6} txns={:<8} {:>10.1f} txns/s {:>8.2f} s {:>8} KB peak RSS".format(
+        result['nodes'], result['clients'], result['mode'], result['txns'],
+        result['txns_per_sec'] or 0, result['wall_time'], result['peak_rss_kb'])
+    if baseline and baseline['txns_per_sec'] and result['txns_per_sec']:
+        line += "  {:+.1f}% vs {}".format(
+            (result['txns_per_sec'] / baseline['txns_per_sec'] - 1) * 100, baseline['label'])
+    print(line, flush=True)
+
+
+if __name__ == "__main__":
+    args = read_args()
+    label = args.label or git_version()
+    baselines = load_results(args.results, args.compare) if args.compare else {}
+
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    for node_count in args.nodes:
+        for client_count in args.clients:
+            for mode in args.modes:
+                proc = ctx.Process(target=run_case, args=(node_count, client_count, mode, args.workers, results))
+                proc.start()
+                result = None
+                while result is None and (proc.is_alive() or not results.empty()):
+                    try:
+                        result = results.get(timeout=1)
+                    except queue.Empty:
+                        pass
+                proc.join()
+                if result is None:
+                    print("nodes={} clients={} mode={} failed with exit code {}"
+                          .format(node_count, client_count, mode, proc.exitcode), flush=True)
+                    continue
+
+                result['label'] = label
+                result['timestamp'] = time.time()
+                print_result(result, baselines.get((node_count, client_count, mode)))
+                with open(args.results, 'a') as f:
+                    f.write(json.dumps(result) + os.linesep)
+
+# Usages:
+# python3 benchmark_genesis.py --nodes 4,100 --clients 0,10000 --workers 0
+# python3 benchmark_genesis.py --compare v1.0 --label dev
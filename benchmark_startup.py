@@ -0,0 +1,304 @@
+"""
+Startup and state-rebuild benchmark of the local pool on synthetic ledgers.
+
+For every ledger size a dedicated network is generated with indy_network.py
+whose domain genesis holds that many txns, a mix of NYM, ATTRIB and SCHEMA.
+The pool ledger holds the --nodes NODE txns and the config ledger stays empty.
+The local nodes are then started three times with launch_local_pool.py:
+
+    genesis  empty data dirs, the nodes import the genesis into their ledgers
+    warm     restart with ledgers and state in place, as after an upgrade
+    rebuild  restart after removing the state dbs, rebuilt from the ledgers
+
+and every start measures the seconds until
+    init_s           the node stack listens: ledgers loaded, state initialized
+    ready_s          the node reports participating (info file period applies)
+    first_ordered_s  the first ATTRIB write is ordered and answered
+Each start is appended to the results file and a scaling table is printed.
+The network name in /etc/indy/indy_config.py is restored at the end.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+from indy.error import IndyError
+
+from indy_common.config_helper import ConfigHelper, NodeConfigHelper
+from indy_common.config_util import getConfig
+from indy_common.constants import ATTRIB, SCHEMA, RAW, SCHEMA_NAME, SCHEMA_VERSION, SCHEMA_ATTR_NAMES
+from indy_common.txn_util import getTxnOrderedFields
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+from plenum.common.constants import TARGET_NYM, DATA
+from plenum.common.txn_util import init_empty_txn, set_payload_data, append_payload_metadata, \
+    append_txn_metadata
+
+from indy_network import NetworkSetup, GenesisLedgerWriter
+from generate_indy_pool_transactions import portsStart, nodeParamsFileName
+from key_cache import KeyCache
+from launch_local_pool import LocalPool, read_pool_nodes
+from load_generator import LoadGenerator, write_attrib
+from tune_pool import write_overrides, clear_node_data, INDY_CONFIG_FILE
+
+BENCH_NETWORK = 'startup_bench'
+DEFAULT_SIZES = '10000,100000,1000000'
+DEFAULT_TXN_MIX = 'nym=0.5,attrib=0.3,schema=0.2'
+START_MODES = ('genesis', 'warm', 'rebuild')
+# ATTRIBs are spread over the first clients only, so their DIDs can stay in memory
+ATTRIB_TARGETS = 1000
+POLL_INTERVAL = 0.1
+
+
+def _type_sizes(value):
+    try:
+        sizes = sorted(int(size) for size in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma separated txn counts, got {!r}".format(value))
+    if not sizes or sizes[0] <= 0:
+        raise argparse.ArgumentTypeError("sizes should be > 0")
+    return sizes
+
+
+def _type_txn_mix(value):
+    mix = {}
+    for part in value.split(','):
+        txn_type, sep, share = part.partition('=')
+        if txn_type.strip() not in ('nym', 'attrib', 'schema') or not sep:
+            raise argparse.ArgumentTypeError("expected nym=, attrib= and schema= shares, got {!r}".format(part))
+        try:
+            mix[txn_type.strip()] = float(share)
+        except ValueError:
+            raise argparse.ArgumentTypeError("{!r} is not a valid share".format(share))
+    if mix.get('nym', 0) <= 0:
+        raise argparse.ArgumentTypeError("the nym share should be > 0, ATTRIBs are sent by the clients")
+    return mix
+
+
+def split_size(size, mix):
+    total = sum(mix.values())
+    counts = {txn_type: int(size * share / total) for txn_type, share in mix.items()}
+    counts['nym'] = size - counts.get('attrib', 0) - counts.get('schema', 0)
+    return counts
+
+
+def attrib_txn(dest, idx, seq_no):
+    txn = init_empty_txn(ATTRIB)
+    set_payload_data(txn, {TARGET_NYM: dest, RAW: json.dumps({'synthetic': idx})})
+    append_payload_metadata(txn, frm=dest)
+    # Genesis txns carry their seqNo and no txn time, like the NYMs before them
+    return append_txn_metadata(txn, seq_no=seq_no)
+
+
+def schema_txn(author, idx, seq_no):
+    txn = init_empty_txn(SCHEMA)
+    set_payload_data(txn, {DATA: {SCHEMA_NAME: 'synthetic{}'.format(idx), SCHEMA_VERSION: '1.0',
+                                  SCHEMA_ATTR_NAMES: ['name', 'age', 'height']}})
+    append_payload_metadata(txn, frm=author)
+    return append_txn_metadata(txn, seq_no=seq_no)
+
+
+def generate_network(config, network, node_count, counts, workers, key_cache):
+    steward_defs, node_defs = NetworkSetup.gen_defs(None, None, None, node_count, portsStart,
+                                                    workers, cache=key_cache)
+    trustee_def = NetworkSetup.gen_trustee_def(None, workers, key_cache)
+
+    attrib_targets = []
+
+    def client_defs():
+        for cd in NetworkSetup.iter_client_defs(counts['nym'], workers, key_cache):
+            if len(attrib_targets) < ATTRIB_TARGETS:
+                attrib_targets.append(cd.nym)
+            yield cd
+
+    NetworkSetup.bootstrap_nodes_core(config, network, False, getTxnOrderedFields(), trustee_def,
+                                      steward_defs, node_defs, client_defs(),
+                                      [nd.idx for nd in node_defs], nodeParamsFileName,
+                                      ConfigHelper, NodeConfigHelper, workers=workers, key_cache=key_cache)
+
+    # ATTRIB and SCHEMA txns go after the NYMs, and the manifest is written again
+    genesis_dir = ConfigHelper(config).genesis_dir
+    domain = GenesisLedgerWriter(
+        NetworkSetup.init_domain_ledger(True, genesis_dir, config, getTxnOrderedFields()),
+        genesis_txn_path(genesis_dir, NetworkSetup.domain_ledger_file_name(config)))
+    for idx, dest in zip(range(counts.get('attrib', 0)), itertools.cycle(attrib_targets)):
+        domain.add(attrib_txn(dest, idx, domain.next_seq_no))
+    for idx in range(counts.get('schema', 0)):
+        domain.add(schema_txn(trustee_def[0].nym, idx, domain.next_seq_no))
+    domain.stop()
+    pool = GenesisLedgerWriter(
+        NetworkSetup.init_pool_ledger(True, genesis_dir, config),
+        genesis_txn_path(genesis_dir, NetworkSetup.pool_ledger_file_name(config)))
+    pool.stop()
+    NetworkSetup.write_genesis_manifest(genesis_dir, [pool, domain])
+    return pool.file_path
+
+
+def remove_state(config, nodes):
+    for name, *_ in nodes:
+        ledger_dir = NodeConfigHelper(name, config).ledger_dir
+        for entry in os.listdir(ledger_dir):
+            if entry.endswith('_state'):
+                shutil.rmtree(os.path.join(ledger_dir, entry))
+
+
+def wait_listening(pool, timeout):
+    """
+    Seconds after the start until the node stack of every node accepts connections
+    """
+    listening = {}
+    deadline = time.time() + timeout
+    while len(listening) < len(pool.nodes) and time.time() < deadline and not pool.exited():
+        for name, nIp, nPort, *_ in pool.nodes:
+            if name in listening:
+                continue
+            try:
+                socket.create_connection((nIp, nPort), timeout=POLL_INTERVAL).close()
+                listening[name] = time.time() - pool.started_at
+            except OSError:
+                pass
+        time.sleep(POLL_INTERVAL)
+    return listening
+
+
+def first_ordered(genesis_file, pool, timeout):
+    """
+    Seconds after the start until an ATTRIB write is ordered, retried from the
+    moment the stacks listen, so it does not wait for the info files of the nodes
+    """
+
+    async def _run():
+        deadline = time.time() + timeout
+        generator = None
+        try:
+            while time.time() < deadline and not pool.exited():
+                if generator is None:
+                    candidate = LoadGenerator(genesis_file, 1, 1, 1, None, 1, None)
+                    try:
+                        await candidate.open()
+                        generator = candidate
+                    except IndyError:
+                        # The nodes do not answer the pool ledger catch-up yet
+                        await candidate.close()
+                        await asyncio.sleep(POLL_INTERVAL)
+                        continue
+                client_did, client_verkey = generator.clients[0]
+                try:
+                    if await write_attrib(generator.pool_handle, generator.wallet_handle,
+                                          client_did, client_verkey, 0):
+                        return time.time() - pool.started_at
+                except IndyError:
+                    pass
+                await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            if generator is not None:
+                await generator.close()
+
+    return asyncio.get_event_loop().run_until_complete(_run())
+
+
+def measure_start(config, nodes, genesis_file, mode, args):
+    pool = LocalPool(config, nodes, args.logDir, nodeParamsFileName)
+    readiness = {}
+    try:
+        pool.start()
+        listening = wait_listening(pool, args.readyTimeout)
+        # Readiness is polled from the info files meanwhile, first_ordered_s is independent of their period
+        ready_thread = threading.Thread(target=lambda: readiness.update(ready=pool.wait_ready(args.readyTimeout)))
+        ready_thread.start()
+        first = first_ordered(genesis_file, pool, args.readyTimeout) if len(listening) == len(nodes) else None
+        ready_thread.join()
+    finally:
+        pool.stop(args.stopTimeout)
+    ready = readiness.get('ready', False)
+    return {
+        'mode': mode,
+        'init_s': max(listening.values()) if len(listening) == len(nodes) else None,
+        'ready_s': max(pool.ready_after.values()) if ready else None,
+        'first_ordered_s': first,
+        'per_node_init_s': listening,
+    }
+
+
+def format_seconds(value):
+    return '{:>9.1f}'.format(value) if value is not None else '      n/a'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark node startup and state rebuild on synthetic ledgers')
+    parser.add_argument('--sizes', required=False, type=_type_sizes, default=_type_sizes(DEFAULT_SIZES),
+                        help="domain ledger sizes in txns (default {})".format(DEFAULT_SIZES))
+    parser.add_argument('--txnMix', required=False, type=_type_txn_mix, default=_type_txn_mix(DEFAULT_TXN_MIX),
+                        help="shares of NYM, ATTRIB and SCHEMA txns (default {})".format(DEFAULT_TXN_MIX))
+    parser.add_argument('--nodes', required=False, type=NetworkSetup._bootstrap_args_type_node_count, default=4,
+                        help="number of local nodes (default 4)")
+    parser.add_argument('--network', required=False, type=str, default=BENCH_NETWORK,
+                        help="network generated for the benchmark, removed at every size "
+                             "(default {})".format(BENCH_NETWORK))
+    parser.add_argument('--modes', nargs='+', required=False, choices=START_MODES, default=list(START_MODES),
+                        help="starts to measure at every size (default: all)")
+    parser.add_argument('--results', required=False, type=str, default='startup_results.jsonl',
+                        help="file the starts are appended to as JSON lines (default startup_results.jsonl)")
+    parser.add_argument('--workers', required=False, type=NetworkSetup._bootstrap_args_type_workers, default='0',
+                        help="worker processes for key derivation, 0 means one per CPU (default 0)")
+    parser.add_argument('--keyCache', required=False, type=str,
+                        help="directory to cache the derived client keys in between sizes and runs")
+    parser.add_argument('--configFile', required=False, type=str, default=INDY_CONFIG_FILE,
+                        help="node config file (default {})".format(INDY_CONFIG_FILE))
+    parser.add_argument('--logDir', required=False, type=str, default='local_pool_logs',
+                        help="directory for the output of the nodes (default local_pool_logs)")
+    parser.add_argument('--readyTimeout', required=False, type=float, default=3600,
+                        help="seconds to wait for every milestone of a start (default 3600)")
+    parser.add_argument('--stopTimeout', required=False, type=float, default=60,
+                        help="seconds to wait for the nodes to exit before killing them (default 60)")
+    args = parser.parse_args()
+
+    config = getConfig()
+    key_cache = KeyCache(args.keyCache) if args.keyCache else None
+    with open(args.configFile) as f:
+        original_config = f.read()
+
+    rows = []
+    try:
+        write_overrides(args.configFile, original_config, [('NETWORK_NAME', args.network)])
+        with open(args.results, 'a') as results:
+            for size in args.sizes:
+                counts = split_size(size, args.txnMix)
+                print("Generating {} with {} txns: {}".format(args.network, size, counts))
+                started = time.perf_counter()
+                genesis_file = generate_network(config, args.network, args.nodes, counts, args.workers, key_cache)
+                if key_cache:
+                    key_cache.evict()
+                generate_s = time.perf_counter() - started
+                nodes = read_pool_nodes(genesis_file)
+                clear_node_data(config, nodes)
+
+                for mode in START_MODES:
+                    # The genesis import always runs, the restarts need its ledgers
+                    if mode != 'genesis' and mode not in args.modes:
+                        continue
+                    if mode == 'rebuild':
+                        remove_state(config, nodes)
+                    result = measure_start(config, nodes, genesis_file, mode, args)
+                    if mode not in args.modes:
+                        continue
+                    result.update(size=size, counts=counts, nodes=args.nodes, generate_s=generate_s)
+                    rows.append(result)
+                    results.write(json.dumps(result) + '\n')
+                    results.flush()
+    finally:
+        with open(args.configFile, 'w') as f:
+            f.write(original_config)
+
+    print("\n{:>10} {:>8} {:>9} {:>9} {:>9}".format('txns', 'start', 'init s', 'ready s', '1st ord s'))
+    for row in sorted(rows, key=lambda r: (START_MODES.index(r['mode']), r['size'])):
+        print("{:>10} {:>8} {} {} {}".format(row['size'], row['mode'], format_seconds(row['init_s']),
+                                             format_seconds(row['ready_s']), format_seconds(row['first_ordered_s'])))
+
+# Usages:
+# sudo python3 benchmark_startup.py
+# sudo python3 benchmark_startup.py --sizes 100000,1000000 --modes warm rebuild --keyCache /tmp/indy_keys
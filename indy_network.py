@@ -1,26 +1,236 @@
 import argparse
+import collections
+import concurrent.futures
+import hashlib
 import ipaddress
+import itertools
+import json
 import os
-from collections import namedtuple
+import shutil
+import tarfile
+from collections import namedtuple, OrderedDict
 import fileinput
 
 from common.exceptions import PlenumValueError
 
-from ledger.genesis_txn.genesis_txn_file_util import create_genesis_txn_init_ledger
+from ledger.genesis_txn.genesis_txn_file_util import create_genesis_txn_init_ledger, genesis_txn_path
 
 from stp_core.crypto.nacl_wrappers import Signer
 
 from plenum.common.member.member import Member
 from plenum.common.member.steward import Steward
 
-from plenum.common.keygen_utils import initNodeKeysForBothStacks, init_bls_keys
-from plenum.common.constants import TRUSTEE, STEWARD
+from plenum.common.keygen_utils import initNodeKeysForBothStacks
+from plenum.bls.bls_crypto_factory import create_default_bls_crypto_factory
+from plenum.common.constants import TRUSTEE, STEWARD, NODE, TARGET_NYM, DATA, ALIAS
+from plenum.common.txn_util import get_type, get_payload_data
+from ledger.ledger import Ledger
 from plenum.common.config_helper import PConfigHelper, PNodeConfigHelper
 from plenum.common.util import hexToFriendly, is_hostname_valid
 from plenum.common.signer_did import DidSigner
 from stp_core.common.util import adict
 
+from key_cache import KeyCache, DEFAULT_KEY_CACHE_SIZE
+from phase_timer import PhaseTimer
+from seed_file import SeedFile, SeedFileError
+from node_ordering import load_latency_matrix, order_nodes
+
 CLIENT_CONNECTIONS_LIMIT = 500
+MAX_PORT = 65535
+KEY_DERIVATION_CHUNK_SIZE = 256
+BLS_KEYS_CHUNK_SIZE = 8
+GENESIS_WRITE_BUFFER_SIZE = 1024 * 1024
+GENESIS_COMMIT_BATCH_SIZE = 10000
+CLIENT_PROGRESS_INTERVAL = 100000
+GENESIS_MANIFEST_FILE = 'genesis_manifest.json'
+INDY_CONFIG_FILE = '/etc/indy/indy_config.py'
+# Network name of a bundle, in its config dir, set by install_bundle.py
+BUNDLE_NETWORK_FILE = 'bundle_network'
+
+
+def _derive_did_keys(sigseeds):
+    # Runs in worker processes, so it has to stay a module level function
+    keys = []
+    for sigseed in sigseeds:
+        signer = DidSigner(seed=sigseed)
+        keys.append((signer.identifier, signer.verkey))
+    return keys
+
+
+def _derive_node_verkeys(sigseeds):
+    return [Signer(sigseed).verhex for sigseed in sigseeds]
+
+
+def _derive_bls_keys(sigseeds):
+    # Only the public key and its proof of possession are kept,
+    # the secret key is never written anywhere
+    bls_factory = create_default_bls_crypto_factory()
+    keys = []
+    for sigseed in sigseeds:
+        _, pk, key_proof = bls_factory.generate_bls_keys(seed=sigseed)
+        keys.append((pk, key_proof))
+    return keys
+
+
+def _make_bundle_tarball(bundle_dir):
+    with tarfile.open(bundle_dir + '.tar.gz', 'w:gz') as tar:
+        for name in sorted(os.listdir(bundle_dir)):
+            tar.add(os.path.join(bundle_dir, name), arcname=name)
+    shutil.rmtree(bundle_dir)
+    return bundle_dir + '.tar.gz'
+
+
+def _init_node_keys(nodes):
+    keys = []
+    for name, keys_dir, sigseed in nodes:
+        _, verkey, blskey, key_proof = initNodeKeysForBothStacks(name, keys_dir, sigseed, override=True)
+        keys.append((verkey.encode(), blskey, key_proof))
+    return keys
+
+
+class GenesisLedgerWriter:
+    """
+    Collects the txns of a genesis ledger and commits them as one bulk
+    append: a single merkle tree update and a single buffered write of the
+    genesis file, instead of one of each per `Ledger.add`.
+
+    Txns are committed every GENESIS_COMMIT_BATCH_SIZE txns and only the
+    compact merkle frontier is kept, so memory does not grow with the ledger.
+
+    In incremental mode the txns already in the ledger are indexed by digest
+    and by (type, dest/alias), and `add` only takes txns that are not there yet.
+    That index holds every existing and added txn, so there memory does grow
+    with the ledger, by about two hashes per txn.
+    """
+
+    def __init__(self, ledger, file_path, incremental=False):
+        self.ledger = ledger
+        self.file_path = file_path
+        self.incremental = incremental
+        self._hasher = ledger.tree.hasher
+        self._frontier = list(ledger.tree.hashes)
+        self._size = ledger.size
+        self._txns = []
+        self._digests = set()
+        self._keys = {}
+        self._skipped = 0
+        self._added = 0
+        self._written = False
+        self.txn_count = None
+        self.root_hash = None
+        if incremental:
+            for _, txn in ledger.getAllTxn():
+                self._index(txn)
+
+    @staticmethod
+    def txn_digest(txn):
+        # seqNo is part of txnMetadata, so it is left out to find
+        # the same txn regardless of its position in the ledger
+        data = {k: v for k, v in txn.items() if k != 'txnMetadata'}
+        return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+    @staticmethod
+    def txn_key(txn):
+        txn_type = get_type(txn)
+        payload = get_payload_data(txn)
+        if txn_type == NODE:
+            return txn_type, payload.get(DATA, {}).get(ALIAS)
+        if TARGET_NYM in payload:
+            return txn_type, payload[TARGET_NYM]
+        return None
+
+    def _index(self, txn):
+        digest = self.txn_digest(txn)
+        self._digests.add(digest)
+        key = self.txn_key(txn)
+        if key is not None:
+            self._keys[key] = digest
+
+    @property
+    def next_seq_no(self):
+        return self._size + len(self._txns) + 1
+
+    def _append_leaf(self, leaf):
+        # Merge the full subtrees of equal size, as CompactMerkleTree does
+        node = self._hasher.hash_leaf(leaf)
+        size = self._size
+        while size & 1:
+            node = self._hasher.hash_children(self._frontier.pop(), node)
+            size >>= 1
+        self._frontier.append(node)
+        self._size += 1
+
+    @property
+    def _root_hash(self):
+        if not self._frontier:
+            return self._hasher.hash_empty()
+        root = self._frontier[-1]
+        for node in reversed(self._frontier[:-1]):
+            root = self._hasher.hash_children(node, root)
+        return root
+
+    def add(self, txn):
+        """
+        Returns False if the txn was skipped as already present in the ledger
+        """
+        if self.incremental:
+            digest = self.txn_digest(txn)
+            key = self.txn_key(txn)
+            if digest in self._digests or key in self._keys:
+                if digest != self._keys.get(key, digest):
+                    print("{} {} differs from the one in {}, keeping the existing one"
+                          .format(*key, self.file_path))
+                self._skipped += 1
+                return False
+            self._index(txn)
+        self._added += 1
+        self._txns.append(txn)
+        if len(self._txns) >= GENESIS_COMMIT_BATCH_SIZE:
+            self.commit()
+        return True
+
+    def _missing_line_separator(self):
+        # Hand edited or downloaded genesis files may not end with a newline
+        try:
+            with open(self.file_path, 'rb') as f:
+                if f.seek(0, os.SEEK_END) == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) not in (b'\n', b'\r')
+        except FileNotFoundError:
+            return False
+
+    def commit(self):
+        if not self._txns:
+            return
+
+        lines = []
+        if not self._written:
+            self._written = True
+            if self._missing_line_separator():
+                lines.append(os.linesep)
+        for txn in self._txns:
+            line = self.ledger.serialize_for_txn_log(txn)
+            if isinstance(line, bytes):
+                line = line.decode()
+            lines.append(line + os.linesep)
+
+        # The size used for the next seq_no includes the buffered txns,
+        # so the buffer is cleared before the tree is extended
+        txns, self._txns = self._txns, []
+        for txn in txns:
+            self._append_leaf(self.ledger.serialize_for_tree(txn))
+        with open(self.file_path, 'a', buffering=GENESIS_WRITE_BUFFER_SIZE) as f:
+            f.writelines(lines)
+
+    def stop(self):
+        self.commit()
+        if self.incremental:
+            print("Appended {} new txns to {}, {} already present"
+                  .format(self._added, self.file_path, self._skipped))
+        self.txn_count = self._size
+        self.root_hash = Ledger.hashToStr(self._root_hash)
+        self.ledger.stop()
 
 
 class NetworkSetup:
@@ -31,12 +241,6 @@ class NetworkSetup:
             raise argparse.ArgumentTypeError('should be a number')
         n = int(nodesStrArg)
 
-        if n > 100:
-            raise argparse.ArgumentTypeError(
-                "Cannot run {} nodes for this setup"
-                "For this setup, we need node number less than 100"
-                "This is not a problem with protocol but some placeholder".format(n)
-                )
         if n <= 0:
             raise argparse.ArgumentTypeError("Should be > 0")
 
@@ -104,86 +308,369 @@ class NetworkSetup:
 
         return trustee_seeds
 
+    @staticmethod
+    def _bootstrap_args_type_seed_file(kind):
+        def seed_file(path):
+            if not os.path.isfile(path) or not os.access(path, os.R_OK):
+                raise argparse.ArgumentTypeError("'{}' is not a readable file".format(path))
+            return SeedFile(path, kind)
+        return seed_file
+
+    @staticmethod
+    def _bootstrap_args_type_latency_matrix(path):
+        try:
+            return load_latency_matrix(path)
+        except (OSError, ValueError) as exc:
+            raise argparse.ArgumentTypeError(str(exc))
+
+    @staticmethod
+    def _bootstrap_args_type_workers(workersStrArg):
+        if not workersStrArg.isdigit():
+            raise argparse.ArgumentTypeError('should be a number')
+        n = int(workersStrArg)
+        return n if n > 0 else os.cpu_count()
+
+    @staticmethod
+    def derive_keys(derive_func, items, workers=None, chunk_size=KEY_DERIVATION_CHUNK_SIZE):
+        """
+        Apply derive_func to items (usually signing seeds) split in chunks of
+        chunk_size, using a pool of worker processes if workers > 1. Results keep
+        the order of items, so the serial and the parallel paths give the same output.
+        """
+        items = list(items)
+        if not workers or workers <= 1 or len(items) <= chunk_size:
+            return derive_func(items)
+
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            return list(itertools.chain.from_iterable(executor.map(derive_func, chunks)))
+
     @classmethod
-    def gen_defs(cls, ips, steward_seeds, node_seeds, node_count, starting_port):
+    def derive_cached_keys(cls, kind, derive_func, sigseeds, workers=None, cache=None,
+                           chunk_size=KEY_DERIVATION_CHUNK_SIZE):
+        """
+        Same as derive_keys, but takes the keys found in cache and only derives
+        the missing ones.
+        """
+        if cache is None:
+            return cls.derive_keys(derive_func, sigseeds, workers, chunk_size)
+
+        sigseeds = list(sigseeds)
+        keys = [cache.get(kind, sigseed) for sigseed in sigseeds]
+        missing = [i for i, key in enumerate(keys) if key is None]
+        if missing:
+            derived = cls.derive_keys(derive_func, [sigseeds[i] for i in missing], workers, chunk_size)
+            for i, key in zip(missing, derived):
+                keys[i] = key
+                cache.put(kind, sigseeds[i], key)
+        return keys
 
-        if not ips:
-            ips = ['127.0.0.1'] * node_count
+    @classmethod
+    def iter_derived_keys(cls, kind, derive_func, sigseeds, workers=None, cache=None,
+                          chunk_size=KEY_DERIVATION_CHUNK_SIZE):
+        """
+        Lazy version of derive_cached_keys, yields (sigseed, key) pairs in order.
+        Seeds are read chunk by chunk and at most two chunks per worker are in
+        flight, so memory does not depend on the number of seeds.
+        """
+        sigseeds = iter(sigseeds)
+        chunks = iter(lambda: list(itertools.islice(sigseeds, chunk_size)), [])
+
+        def lookup(chunk):
+            return [cache.get(kind, sigseed) for sigseed in chunk] if cache else [None] * len(chunk)
+
+        def resolve(chunk, keys, derived):
+            derived = iter(derived)
+            for sigseed, key in zip(chunk, keys):
+                if key is None:
+                    key = next(derived)
+                    if cache:
+                        cache.put(kind, sigseed, key)
+                yield sigseed, key
+
+        if not workers or workers <= 1:
+            for chunk in chunks:
+                keys = lookup(chunk)
+                yield from resolve(chunk, keys, derive_func([s for s, k in zip(chunk, keys) if k is None]))
         else:
-            if len(ips) != node_count:
-                if len(ips) > node_count:
-                    ips = ips[:node_count]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = collections.deque()
+                for chunk in chunks:
+                    keys = lookup(chunk)
+                    pending.append((chunk, keys,
+                                    executor.submit(derive_func, [s for s, k in zip(chunk, keys) if k is None])))
+                    if len(pending) >= workers * 2:
+                        chunk, keys, future = pending.popleft()
+                        yield from resolve(chunk, keys, future.result())
+                while pending:
+                    chunk, keys, future = pending.popleft()
+                    yield from resolve(chunk, keys, future.result())
+
+    @classmethod
+    def init_node_keys(cls, node_defs, localNodes, keys_dir, workers=None, key_cache=None):
+        """
+        Return {idx: (verkey, blskey, key_proof)} for every node. Full key sets
+        are written to keys_dir for the local nodes only, the other nodes just
+        need their BLS public key and proof of possession for the pool genesis.
+        """
+        local_node_defs = [nd for nd in node_defs if nd.idx in localNodes]
+        remote_node_defs = [nd for nd in node_defs if nd.idx not in localNodes]
+
+        local_keys = cls.derive_keys(_init_node_keys,
+                                     [(nd.name, keys_dir, nd.sigseed) for nd in local_node_defs],
+                                     workers, chunk_size=1)
+        remote_bls_keys = cls.derive_cached_keys('bls', _derive_bls_keys,
+                                                 [nd.sigseed for nd in remote_node_defs],
+                                                 workers, key_cache, BLS_KEYS_CHUNK_SIZE)
+
+        node_keys = {}
+        for nd, (verkey, blskey, key_proof) in zip(local_node_defs, local_keys):
+            assert verkey == nd.verkey
+            node_keys[nd.idx] = (verkey, blskey, key_proof)
+        for nd, (blskey, key_proof) in zip(remote_node_defs, remote_bls_keys):
+            node_keys[nd.idx] = (nd.verkey, blskey, key_proof)
+        return node_keys
+
+    @staticmethod
+    def bundle_path(bundles_dir, host, path):
+        """
+        Path inside the bundle of host that is extracted to path on the host
+        """
+        return os.path.join(bundles_dir, host, os.path.abspath(path).lstrip(os.sep))
+
+    @classmethod
+    def init_bundle_node_keys(cls, node_defs, localNodes, bundles_dir, keys_dir, workers=None):
+        """
+        Same as init_node_keys with all nodes local, but the full key set of
+        every node is written to the keys dir inside the bundle of its host.
+        The local nodes also get theirs in keys_dir, as without bundles.
+        """
+        keys = cls.derive_keys(_init_node_keys,
+                               [(nd.name, cls.bundle_path(bundles_dir, nd.ip, keys_dir), nd.sigseed)
+                                for nd in node_defs] +
+                               [(nd.name, keys_dir, nd.sigseed) for nd in node_defs if nd.idx in localNodes],
+                               workers, chunk_size=1)
+        node_keys = {}
+        for nd, (verkey, blskey, key_proof) in zip(node_defs, keys):
+            assert verkey == nd.verkey
+            node_keys[nd.idx] = (verkey, blskey, key_proof)
+        return node_keys
+
+    @staticmethod
+    def plan_host_resources(node_defs, host_cpus=None, host_connections=None):
+        """
+        Split the CPUs and the client connections of every host between the
+        nodes it runs, so that co-located nodes don't compete for the same cores.
+        A node alone on its host gets no CPU affinity. CPUs are numbered among the
+        ones the node may use, see start_indy_node.py. host_connections is the
+        client connections budget of a host, by default every node keeps
+        CLIENT_CONNECTIONS_LIMIT.
+        """
+        # The CPUs this process may use, a cpuset or taskset can allow fewer than os.cpu_count()
+        host_cpus = host_cpus or len(os.sched_getaffinity(0))
+        hosts = OrderedDict()
+        for nd in node_defs:
+            hosts.setdefault(nd.ip, []).append(nd)
+
+        resources = {}
+        for host_node_defs in hosts.values():
+            count = len(host_node_defs)
+            limit = max(1, host_connections // count) if host_connections else CLIENT_CONNECTIONS_LIMIT
+            first_cpu = 0
+            for i, nd in enumerate(host_node_defs):
+                if count == 1:
+                    cpu_affinity = None
+                elif count > host_cpus:
+                    cpu_affinity = str(i % host_cpus)
                 else:
-                    ips += ['127.0.0.1'] * (node_count - len(ips))
-
-        if ( steward_seeds == None ):
-            steward_seeds = []
-            for i in range(1, node_count+1):
-                    seed = "Steward" + str(i)
-                    seed=('0'*(32 - len(seed)) + seed) 
-                    steward_seeds.append(seed)
-        
-        elif len(steward_seeds) != node_count:
-            if len(steward_seeds) > node_count:
-                steward_seeds = steward_seeds[:node_count]
+                    # The first host_cpus % count nodes take one of the remaining cores each
+                    cpus = host_cpus // count + (1 if i < host_cpus % count else 0)
+                    cpu_affinity = str(first_cpu) if cpus == 1 else '{}-{}'.format(first_cpu, first_cpu + cpus - 1)
+                    first_cpu += cpus
+                resources[nd.idx] = NodeResources(cpu_affinity=cpu_affinity,
+                                                  client_connections_limit=limit)
+        return resources
+
+    @staticmethod
+    def node_params_file_name(nodeParamsFileName, name, shared):
+        # Nodes set up in the same config dir can't share one params file, a node
+        # alone there keeps the one the indy-node service loads as its EnvironmentFile
+        return '{}_{}'.format(name, nodeParamsFileName) if shared else nodeParamsFileName
+
+    @classmethod
+    def write_node_params(cls, paramsFilePath, nd, resources):
+        cls.write_node_params_file(paramsFilePath, nd.name,
+                                   "0.0.0.0", nd.port,
+                                   "0.0.0.0", nd.client_port,
+                                   client_connections_limit=resources.client_connections_limit,
+                                   cpu_affinity=resources.cpu_affinity)
+
+    @staticmethod
+    def write_network_name(config_file, network):
+        for line in fileinput.input([config_file], inplace=True):
+            if 'NETWORK_NAME' not in line:
+                print(line, end="")
+        with open(config_file, 'a') as cfgfile:
+            cfgfile.write("NETWORK_NAME = '{}'".format(network))
+
+    @classmethod
+    def write_bundles(cls, node_defs, bundles_dir, bundle_format, genesis_files, params_dir, nodeParamsFileName,
+                      resources, network, workers=None):
+        """
+        Complete the per host bundles with the genesis files, a params file
+        per node and the network name, then pack them as <host>.tar.gz if
+        bundle_format is 'tar'. A bundle is installed on its host by
+        install_bundle.py, which extracts it to / and sets the network name
+        in the indy config, as --nodeNum does.
+        """
+        hosts = OrderedDict()
+        for nd in node_defs:
+            hosts.setdefault(nd.ip, []).append(nd)
+
+        for host, host_node_defs in hosts.items():
+            for file_path in genesis_files:
+                bundle_file_path = cls.bundle_path(bundles_dir, host, file_path)
+                os.makedirs(os.path.dirname(bundle_file_path), exist_ok=True)
+                shutil.copy2(file_path, bundle_file_path)
+
+            bundle_params_dir = cls.bundle_path(bundles_dir, host, params_dir)
+            os.makedirs(bundle_params_dir, exist_ok=True)
+            with open(os.path.join(bundle_params_dir, BUNDLE_NETWORK_FILE), 'w') as f:
+                f.write(network)
+            for nd in host_node_defs:
+                params_file_name = cls.node_params_file_name(nodeParamsFileName, nd.name, len(host_node_defs) > 1)
+                cls.write_node_params(os.path.join(bundle_params_dir, params_file_name), nd, resources[nd.idx])
+
+        bundles = [os.path.join(bundles_dir, host) for host in hosts]
+        if bundle_format == 'tar':
+            if workers and workers > 1:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                    bundles = list(executor.map(_make_bundle_tarball, bundles))
             else:
-                current_steward_seeds_list_length = len(steward_seeds)
-                for i in range(current_steward_seeds_list_length+1, node_count+1):
-                    seed = "Steward" + str(i)
-                    seed=('0'*(32 - len(seed)) + seed) 
-                    steward_seeds.append(seed) 
-
-        if ( node_seeds == None):
-            node_seeds = []
-            for i in range(1, node_count+1):
-                seed = "Node" + str(i) 
-                seed=('0'*(32 - len(seed)) + seed)
-                node_seeds.append(seed)
-
-        elif len(node_seeds) != node_count:
-            if len(node_seeds) > node_count:
-                node_seeds = node_seeds[:node_count] 
+                bundles = [_make_bundle_tarball(bundle) for bundle in bundles]
+
+        for host, bundle in zip(hosts, bundles):
+            print("Bundle for {} written to {}".format(host, bundle))
+
+    @staticmethod
+    def plan_node_addresses(ips, node_count, starting_port, spread_hosts=False):
+        """
+        Return (ip, node_port, client_port) for every node.
+
+        By default node i gets the i-th IP (or the loopback IP if there are
+        not enough of them) and ports starting_port + 2i - 1, starting_port + 2i.
+        With spread_hosts the nodes are assigned to the IPs round-robin and
+        ports are allocated per host, so every host only needs two ports
+        per node it runs.
+        """
+        if not ips:
+            ips = ['127.0.0.1']
+            spread_hosts = True
+
+        if spread_hosts:
+            nodes_per_host = -(-node_count // len(ips))
+        else:
+            nodes_per_host = node_count
+
+        last_port = starting_port + nodes_per_host * 2
+        if nodes_per_host * 2 > MAX_PORT:
+            # No starting port fits, the nodes have to be spread over more hosts
+            raise PlenumValueError(
+                'node_count', node_count,
+                "at most {} node(s) per host, {}".format(
+                    MAX_PORT // 2,
+                    "spread them over more --ips" if spread_hosts else "use --largePool with more --ips")
+            )
+        if starting_port < 0 or last_port > MAX_PORT:
+            raise PlenumValueError(
+                'starting_port', starting_port,
+                ">= 0 && <= {} for {} node(s) per host".format(MAX_PORT - nodes_per_host * 2, nodes_per_host)
+            )
+
+        addresses = []
+        for i in range(node_count):
+            if spread_hosts:
+                ip = ips[i % len(ips)]
+                slot = i // len(ips)
             else:
-                current_node_seeds_list_length = len(node_seeds)
-                for i in range(current_node_seeds_list_length+1, node_count+1):
-                    seed = "Node" + str(i) 
-                    seed=('0'*(32-len(seed)) + seed)
-                    node_seeds.append(seed)         
-        
+                ip = ips[i] if i < len(ips) else '127.0.0.1'
+                slot = i
+            port = starting_port + slot * 2 + 1
+            addresses.append((ip, port, port + 1))
+        return addresses
+
+    @classmethod
+    def gen_defs(cls, ips, steward_seeds, node_seeds, node_count, starting_port, workers=None,
+                 spread_hosts=False, cache=None):
+
+        addresses = cls.plan_node_addresses(ips, node_count, starting_port, spread_hosts)
+
+        steward_seeds = cls.pad_seeds(steward_seeds, "Steward", node_count)
+        node_seeds = cls.pad_seeds(node_seeds, "Node", node_count)
+
+        steward_sigseeds = [cls.get_signing_seed(seed) for seed in steward_seeds[:node_count]]
+        node_sigseeds = [cls.get_signing_seed(seed) for seed in node_seeds[:node_count]]
+        steward_keys = cls.derive_cached_keys('did', _derive_did_keys, steward_sigseeds, workers, cache)
+        node_verkeys = cls.derive_cached_keys('node', _derive_node_verkeys, node_sigseeds, workers, cache)
 
         steward_defs = []
         node_defs = []
         for i in range(1, node_count + 1):
             d = adict()
             d.name = "Steward" + str(i)
-            d.sigseed = cls.get_signing_seed(steward_seeds[i-1])
-            s_signer = DidSigner(seed=d.sigseed)
-            d.nym = s_signer.identifier
-            d.verkey = s_signer.verkey
+            d.sigseed = steward_sigseeds[i-1]
+            d.nym, d.verkey = steward_keys[i-1]
             steward_defs.append(d)
 
             name = "Node" + str(i)
-            sigseed = cls.get_signing_seed(node_seeds[i-1])
+            ip, port, client_port = addresses[i-1]
             node_defs.append(NodeDef(
                 name=name,
-                ip=ips[i-1],
-                port=starting_port + (i*2) - 1,
-                client_port=starting_port + (i*2),
+                ip=ip,
+                port=port,
+                client_port=client_port,
                 idx=i,
-                sigseed=sigseed,
-                verkey=Signer(sigseed).verhex,
+                sigseed=node_sigseeds[i-1],
+                verkey=node_verkeys[i-1],
                 steward_nym=d.nym))
         return steward_defs, node_defs    
 
 
+    @staticmethod
+    def pad_seeds(seeds, prefix, count):
+        """
+        Cut seeds down to count items, or fill them up with the default seeds:
+        prefix + index, left-padded with zeros to 32 characters.
+        """
+        seeds = list(itertools.islice(seeds or [], count))
+        for i in range(len(seeds) + 1, count + 1):
+            seed = prefix + str(i)
+            seeds.append('0' * (32 - len(seed)) + seed)
+        return seeds
+
     @staticmethod
     def get_signing_seed(name: str) -> bytes:
         return ('0'*(32 - len(name)) + name).encode()   
 
 
     @classmethod
-    def gen_client_defs(cls, client_count):
-        return [cls.gen_client_def(idx) for idx in range(1, client_count+1)]
+    def gen_client_defs(cls, client_count, workers=None, cache=None):
+        return list(cls.iter_client_defs(client_count, workers, cache))
+
+    @classmethod
+    def iter_client_defs(cls, client_count, workers=None, cache=None):
+        """
+        Generator of the same client defs as gen_client_defs, deriving them lazily
+        """
+        sigseeds = (cls.get_signing_seed("Client" + str(idx)) for idx in range(1, client_count+1))
+        client_keys = cls.iter_derived_keys('did', _derive_did_keys, sigseeds, workers, cache)
+        for idx, (sigseed, (nym, verkey)) in enumerate(client_keys, start=1):
+            d = adict()
+            d.name = "Client" + str(idx)
+            d.sigseed = sigseed
+            d.nym = nym
+            d.verkey = verkey
+            yield d
 
     @classmethod
     def gen_client_def(cls, idx):
@@ -196,7 +683,7 @@ class NetworkSetup:
         return d
 
     @classmethod 
-    def gen_trustee_def(cls, trustee_seeds):
+    def gen_trustee_def(cls, trustee_seeds, workers=None, cache=None):
 
         if ( trustee_seeds == None ):
             trustee_seeds = []
@@ -204,14 +691,17 @@ class NetworkSetup:
             seed=('0'*(32 - len(seed)) + seed)
             trustee_seeds.append(seed)
 
+        trustee_sigseeds = [cls.get_signing_seed(seed) for seed in trustee_seeds]
+        if not trustee_sigseeds and isinstance(trustee_seeds, SeedFile):
+            raise SeedFileError('no Trustee seeds in {}'.format(trustee_seeds.path))
+        trustee_keys = cls.derive_cached_keys('did', _derive_did_keys, trustee_sigseeds, workers, cache)
+
         trustee_defs = []
-        for i in range(1, len(trustee_seeds)+1):
+        for i in range(1, len(trustee_sigseeds)+1):
             d = adict()
             d.name = "Trustee" + str(i)
-            d.sigseed = cls.get_signing_seed(trustee_seeds[i-1])
-            t_signer = DidSigner(seed=d.sigseed)
-            d.nym = t_signer.identifier
-            d.verkey = t_signer.verkey
+            d.sigseed = trustee_sigseeds[i-1]
+            d.nym, d.verkey = trustee_keys[i-1]
             trustee_defs.append(d)
 
         return trustee_defs 
@@ -244,19 +734,52 @@ class NetworkSetup:
         return config.domainTransactionsFile
 
     @staticmethod
-    def write_node_params_file(filePath, name, nIp, nPort, cIp, cPort):
+    def write_node_params_file(filePath, name, nIp, nPort, cIp, cPort,
+                               client_connections_limit=CLIENT_CONNECTIONS_LIMIT, cpu_affinity=None):
         contents = [
             'NODE_NAME={}'.format(name),
             'NODE_IP={}'.format(nIp),
             'NODE_PORT={}'.format(nPort),
             'NODE_CLIENT_IP={}'.format(cIp),
             'NODE_CLIENT_PORT={}'.format(cPort),
-            'CLIENT_CONNECTIONS_LIMIT={}'.format(CLIENT_CONNECTIONS_LIMIT)
+            'CLIENT_CONNECTIONS_LIMIT={}'.format(client_connections_limit)
         ]
+        if cpu_affinity is not None:
+            contents.append('NODE_CPU_AFFINITY={}'.format(cpu_affinity))
         with open(filePath, 'w') as f:
             f.writelines(os.linesep.join(contents))
 
     
+    @staticmethod
+    def file_sha256(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(GENESIS_WRITE_BUFFER_SIZE), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    @classmethod
+    def write_genesis_manifest(cls, genesis_dir, ledger_writers):
+        """
+        Record txn count, merkle root, SHA-256, size and mtime of every genesis
+        file, so that they can be verified without re-reading them while unchanged.
+        """
+        manifest = {}
+        for writer in ledger_writers:
+            st = os.stat(writer.file_path)
+            manifest[os.path.basename(writer.file_path)] = {
+                'txn_count': writer.txn_count,
+                'root_hash': writer.root_hash,
+                'sha256': cls.file_sha256(writer.file_path),
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+            }
+
+        manifest_path = os.path.join(genesis_dir, GENESIS_MANIFEST_FILE)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        return manifest_path
+
     @staticmethod
     def get_nym_from_verkey(verkey: bytes):
         return hexToFriendly(verkey)
@@ -266,9 +789,10 @@ class NetworkSetup:
     def bootstrapNodes(cls, config, startingPort, nodeParamsFileName, domainTxnFieldOrder,
                            config_helper_class=PConfigHelper, node_config_helper_class=PNodeConfigHelper,
                            chroot: str=None):
+        timer = PhaseTimer()
         parser = argparse.ArgumentParser(description="Generate pool transactions")
         parser.add_argument('--nodes', required=True,
-                            help='for this setup, node count should be less than 100',
+                            help='node count',
                             type=cls._bootstrap_args_type_node_count)
         parser.add_argument('--clients', required=True, type=int,
                             help='client count')
@@ -281,15 +805,27 @@ class NetworkSetup:
                                   'nodes are assigned the loopback IP, '
                                   'i.e 127.0.0.1',
                             type=cls._bootstrap_args_type_ips_hosts)
-        parser.add_argument('--stewardSeeds',
-                            help='Stewards Seeds, provide comma separated seeds',
-                            type=cls._bootstrap_args_type_steward_seeds)
-        parser.add_argument('--nodeSeeds',
-                            help='Node Seeds, provide comma separated seeds',
-                            type=cls._bootstrap_args_type_node_seeds)
-        parser.add_argument('--trusteeSeeds',
-                            help='Trustee Seeds, provide comma separated seeds',
-                            type=cls._bootstrap_args_type_trustee_seeds)
+        steward_seeds_group = parser.add_mutually_exclusive_group()
+        steward_seeds_group.add_argument('--stewardSeeds',
+                                         help='Stewards Seeds, provide comma separated seeds',
+                                         type=cls._bootstrap_args_type_steward_seeds)
+        steward_seeds_group.add_argument('--stewardSeedsFile',
+                                         help='File with Steward seeds, one per line (CSV or JSON lines)',
+                                         type=cls._bootstrap_args_type_seed_file('Steward'))
+        node_seeds_group = parser.add_mutually_exclusive_group()
+        node_seeds_group.add_argument('--nodeSeeds',
+                                      help='Node Seeds, provide comma separated seeds',
+                                      type=cls._bootstrap_args_type_node_seeds)
+        node_seeds_group.add_argument('--nodeSeedsFile',
+                                      help='File with Node seeds, one per line (CSV or JSON lines)',
+                                      type=cls._bootstrap_args_type_seed_file('Node'))
+        trustee_seeds_group = parser.add_mutually_exclusive_group()
+        trustee_seeds_group.add_argument('--trusteeSeeds',
+                                         help='Trustee Seeds, provide comma separated seeds',
+                                         type=cls._bootstrap_args_type_trustee_seeds)
+        trustee_seeds_group.add_argument('--trusteeSeedsFile',
+                                         help='File with Trustee seeds, one per line (CSV or JSON lines)',
+                                         type=cls._bootstrap_args_type_seed_file('Trustee'))
         parser.add_argument('--network',
                             help='Network name (default sandbox)',
                             type=str,
@@ -300,8 +836,75 @@ class NetworkSetup:
             help="Determine if ledger files needs to be erased "
             "before writing new information or not.",
             action='store_true')
+        parser.add_argument(
+            '--largePool',
+            help="Spread the nodes over the --ips hosts round-robin and "
+            "allocate node/client ports per host instead of per pool.",
+            action='store_true')
+        parser.add_argument('--workers',
+                            help='Number of worker processes used to derive keys, '
+                                 '0 means one per CPU (default 1)',
+                            type=cls._bootstrap_args_type_workers,
+                            default=1)
+        parser.add_argument('--keyCache',
+                            help='Directory of a cache of keys derived from seeds, '
+                                 'reused between runs (disabled by default)',
+                            type=str)
+        parser.add_argument('--keyCacheSize',
+                            help='Maximum disk space of the key cache in MB (default {})'
+                                 .format(DEFAULT_KEY_CACHE_SIZE // (1024 * 1024)),
+                            type=int,
+                            default=DEFAULT_KEY_CACHE_SIZE // (1024 * 1024))
+        parser.add_argument('--bundles',
+                            help='Derive the keys of all the nodes and write a deployment bundle '
+                                 'per host (keys, genesis files, node params and network name) to this directory, '
+                                 'installed on the host by install_bundle.py',
+                            type=str)
+        parser.add_argument('--bundleFormat',
+                            help='Write bundles as directories or as tar.gz files (default dir)',
+                            choices=['dir', 'tar'],
+                            default='dir')
+        parser.add_argument('--hostCpus',
+                            help='CPUs of every host, split between the nodes sharing a host '
+                                 '(default: CPUs of this machine)',
+                            type=int)
+        parser.add_argument('--hostClientConnections',
+                            help='Client connections limit of every host, split between the nodes sharing a host '
+                                 '(default: {} per node)'.format(CLIENT_CONNECTIONS_LIMIT),
+                            type=int)
+        parser.add_argument('--latencyMatrix',
+                            help='File with measured RTTs in ms between the hosts (JSON or CSV), '
+                                 'used to order the nodes in the pool genesis by expected primary latency',
+                            type=cls._bootstrap_args_type_latency_matrix)
+        parser.add_argument('--latencyDecay',
+                            help='Weight ratio between consecutive views when ordering the nodes (default 0.5)',
+                            type=float,
+                            default=0.5)
+        parser.add_argument('--timings',
+                            help='Write wall time, CPU time and peak RSS of every phase to this JSON file',
+                            type=str)
+        parser.add_argument('--cprofile',
+                            help='Write cProfile stats of the whole run to this file',
+                            type=str)
+
+        with timer.phase('parse_args'):
+            args = parser.parse_args()
+
+        timer.cprofile_path = args.cprofile
+        timer.start_profile()
+        try:
+            cls._bootstrap_nodes(args, timer, config, startingPort, nodeParamsFileName, domainTxnFieldOrder,
+                                 config_helper_class, node_config_helper_class, chroot)
+        except SeedFileError as exc:
+            parser.error(str(exc))
+        finally:
+            timer.stop_profile()
+            if args.timings:
+                timer.write_report(args.timings)
 
-        args = parser.parse_args()
+    @classmethod
+    def _bootstrap_nodes(cls, args, timer, config, startingPort, nodeParamsFileName, domainTxnFieldOrder,
+                         config_helper_class, node_config_helper_class, chroot):
 
 
         if isinstance(args.nodeNum, int):
@@ -317,27 +920,52 @@ class NetworkSetup:
                     ">=1 && <= args.nodes {}".format(args.nodes)  
             )  
 
-        node_num = [args.nodeNum, None] if args.nodeNum else [None]
+        key_cache = KeyCache(args.keyCache, args.keyCacheSize * 1024 * 1024) if args.keyCache else None
+
+        with timer.phase('seed_padding'):
+            steward_seeds = cls.pad_seeds(args.stewardSeedsFile or args.stewardSeeds, "Steward", args.nodes)
+            node_seeds = cls.pad_seeds(args.nodeSeedsFile or args.nodeSeeds, "Node", args.nodes)
+
+        with timer.phase('signer_derivation'):
+            steward_defs, node_defs = cls.gen_defs(args.ips, steward_seeds, node_seeds, args.nodes, startingPort,
+                                                   args.workers, args.largePool, key_cache)
 
-        steward_defs, node_defs = cls.gen_defs(args.ips, args.stewardSeeds, args.nodeSeeds, args.nodes, startingPort)
+            # Client identities are derived lazily while their NYMs are written
+            client_defs = cls.iter_client_defs(args.clients, args.workers, key_cache)
 
-        client_defs = cls.gen_client_defs(args.clients)
+            trustee_def = cls.gen_trustee_def(args.trusteeSeedsFile or args.trusteeSeeds, args.workers, key_cache)
 
-        trustee_def = cls.gen_trustee_def(args.trusteeSeeds)
+        if args.latencyMatrix:
+            with timer.phase('node_ordering'):
+                try:
+                    node_defs, latencies, cost, default_cost = order_nodes(node_defs, args.latencyMatrix,
+                                                                           args.latencyDecay)
+                except ValueError as exc:
+                    raise PlenumValueError('latencyMatrix', str(exc), 'RTTs between all the node hosts')
+            print("Pool genesis order (expected quorum latency of the primary):")
+            for nd in node_defs:
+                print("  {} {} {:.1f} ms".format(nd.name, nd.ip, latencies[nd.idx]))
+            print("Predicted primary latency {:.1f} ms, {:.1f} ms in the default order".format(cost, default_cost))
 
 
         if args.nodeNum:
 
-            for line in fileinput.input(['/etc/indy/indy_config.py'], inplace=True):
-                if 'NETWORK_NAME' not in line:
-                    print(line, end="")
-            with open('/etc/indy/indy_config.py', 'a') as cfgfile:
-                cfgfile.write("NETWORK_NAME = '{}'".format(args.network))
+            with timer.phase('indy_config_rewrite'):
+                cls.write_network_name(INDY_CONFIG_FILE, args.network)
 
-        for n_num in node_num:
-            cls.bootstrap_nodes_core(config, args.network, args.appendToLedgers, domainTxnFieldOrder, trustee_def,
-                                       steward_defs, node_defs, client_defs, n_num, nodeParamsFileName,
-                                       config_helper_class, node_config_helper_class)
+        # Keys of all the local nodes and both genesis ledgers are built in a single pass,
+        # the genesis is the same whether or not a node runs on this machine
+        cls.bootstrap_nodes_core(config, args.network, args.appendToLedgers, domainTxnFieldOrder, trustee_def,
+                                 steward_defs, node_defs, client_defs, args.nodeNum, nodeParamsFileName,
+                                 config_helper_class, node_config_helper_class,
+                                 workers=args.workers, key_cache=key_cache, timer=timer,
+                                 bundles_dir=args.bundles, bundle_format=args.bundleFormat,
+                                 host_cpus=args.hostCpus, host_connections=args.hostClientConnections)
+
+        if key_cache:
+            # Once per run, it walks the whole cache
+            with timer.phase('key_cache_evict'):
+                key_cache.evict()
 
 
     @classmethod 
@@ -355,7 +983,14 @@ class NetworkSetup:
             nodeParamsFileName,
             config_helper_class=PConfigHelper,
             node_config_helper_class=PNodeConfigHelper,
-            chroot: str=None):
+            chroot: str=None,
+            workers=None,
+            key_cache=None,
+            timer=None,
+            bundles_dir=None,
+            bundle_format='dir',
+            host_cpus=None,
+            host_connections=None):
         
         if not localNodes:
             localNodes = {}
@@ -368,6 +1003,9 @@ class NetworkSetup:
         except BaseException as exc:
             raise RuntimeError('nodeNum must be an int or set of ints') from exc
 
+        if timer is None:
+            timer = PhaseTimer()
+
         config.NETWORK_NAME = network
 
         config_helper = config_helper_class(config, chroot=chroot)
@@ -375,75 +1013,103 @@ class NetworkSetup:
         genesis_dir = config_helper.genesis_dir
         keys_dir = config_helper.keys_dir
 
-        poolLedger = cls.init_pool_ledger(appendToLedgers, genesis_dir, config)
-        domainLedger = cls.init_domain_ledger(appendToLedgers, genesis_dir,
-                                              config, domainTxnFieldOrder)
+        with timer.phase('bls_keygen'):
+            if bundles_dir:
+                node_keys = cls.init_bundle_node_keys(node_defs, _localNodes, bundles_dir, keys_dir, workers)
+            else:
+                node_keys = cls.init_node_keys(node_defs, _localNodes, keys_dir, workers, key_cache)
+
+        with timer.phase('node_params_file'):
+            resources = cls.plan_host_resources(node_defs, host_cpus, host_connections)
+            local_nodes_per_ip = collections.Counter(nd.ip for nd in node_defs if nd.idx in _localNodes)
+            for nd in node_defs:
+                if nd.idx not in _localNodes:
+                    continue
+                # Several local nodes need their own params file for their CPU set and connections limit,
+                # loopback ones too: launch_local_pool.py reads NODE_CPU_AFFINITY from it
+                shared = local_nodes_per_ip[nd.ip] > 1
+                if nd.ip != '127.0.0.1' or shared:
+                    paramsFilePath = os.path.join(config.GENERAL_CONFIG_DIR,
+                                                  cls.node_params_file_name(nodeParamsFileName, nd.name, shared))
+                    if nd.ip != '127.0.0.1':
+                        print('Nodes will not run locally, so writing {}'.format(paramsFilePath))
+                    else:
+                        print('Nodes share this host, so writing {}'.format(paramsFilePath))
+                    cls.write_node_params(paramsFilePath, nd, resources[nd.idx])
+                
+                print("This node with name {} will use ports {} and {} for nodestack and clientstack respectavely"
+                      .format(nd.name, nd.port, nd.client_port))
+
+        with timer.phase('ledger_writes'):
+            genesis_files = cls.write_genesis_ledgers(config, appendToLedgers, domainTxnFieldOrder, genesis_dir,
+                                                      trustee_def, steward_defs, node_defs, client_defs, node_keys)
+
+        if bundles_dir:
+            with timer.phase('bundles'):
+                cls.write_bundles(node_defs, bundles_dir, bundle_format, genesis_files,
+                                  config.GENERAL_CONFIG_DIR, nodeParamsFileName, resources, network, workers)
+
+    @classmethod
+    def write_genesis_ledgers(cls, config, appendToLedgers, domainTxnFieldOrder, genesis_dir, trustee_def,
+                              steward_defs, node_defs, client_defs, node_keys):
+        poolLedger = GenesisLedgerWriter(
+            cls.init_pool_ledger(appendToLedgers, genesis_dir, config),
+            genesis_txn_path(genesis_dir, cls.pool_ledger_file_name(config)),
+            incremental=appendToLedgers)
+        domainLedger = GenesisLedgerWriter(
+            cls.init_domain_ledger(appendToLedgers, genesis_dir, config, domainTxnFieldOrder),
+            genesis_txn_path(genesis_dir, cls.domain_ledger_file_name(config)),
+            incremental=appendToLedgers)
 
         genesis_protocol_version = None
 
-        seq_no = 1
-        
         for td in trustee_def:
             trustee_txn = Member.nym_txn(td.nym, verkey=td.verkey,
-                                        role=TRUSTEE, seq_no=seq_no,
+                                        role=TRUSTEE, seq_no=domainLedger.next_seq_no,
                                         protocol_version=genesis_protocol_version)
             
-            seq_no += 1
             domainLedger.add(trustee_txn)
 
         for sd in steward_defs:
             nym_txn = Member.nym_txn(sd.nym, verkey=sd.verkey, role=STEWARD, 
-                                    creator= trustee_def[0].nym, seq_no=seq_no,
+                                    creator= trustee_def[0].nym, seq_no=domainLedger.next_seq_no,
                                     protocol_version=genesis_protocol_version)
-            seq_no += 1
             domainLedger.add(nym_txn)
 
 
-        for cd in client_defs:
+        client_count = 0
+        for client_count, cd in enumerate(client_defs, start=1):
             txn = Member.nym_txn(cd.nym, verkey=cd.verkey, creator=trustee_def[0].nym,
-                                 seq_no=seq_no,
+                                 seq_no=domainLedger.next_seq_no,
                                  protocol_version=genesis_protocol_version)
-            seq_no += 1
             domainLedger.add(txn)
+            if client_count % CLIENT_PROGRESS_INTERVAL == 0:
+                print("{} client NYMs written".format(client_count), flush=True)
+        if client_count >= CLIENT_PROGRESS_INTERVAL and client_count % CLIENT_PROGRESS_INTERVAL != 0:
+            print("{} client NYMs written".format(client_count), flush=True)
 
-        seq_no = 1
         for nd in node_defs:
-            if nd.idx in _localNodes:
-                _, verkey, blskey, key_proof = initNodeKeysForBothStacks(nd.name, keys_dir, 
-                                                                        nd.sigseed, override=True)
-                verkey = verkey.encode()
-                assert verkey == nd.verkey
-
-                if nd.ip != '127.0.0.1':
-                    paramsFilePath = os.path.join(config.GENERAL_CONFIG_DIR, nodeParamsFileName)
-                    print('Nodes will not run locally, so writing {}'.format(paramsFilePath))
-                    NetworkSetup.write_node_params_file(paramsFilePath, nd.name,
-                                                    "0.0.0.0", nd.port,
-                                                    "0.0.0.0", nd.client_port)
-                
-                print("This node with name {} will use ports {} and {} for nodestack and clientstack respectavely"
-                      .format(nd.name, nd.port, nd.client_port))
-
-            else:
-                verkey = nd.verkey
-                blskey, key_proof = init_bls_keys(keys_dir, nd.name, nd.sigseed)
+            verkey, blskey, key_proof = node_keys[nd.idx]
             node_nym = cls.get_nym_from_verkey(verkey)
 
             node_txn = Steward.node_txn(nd.steward_nym, nd.name, node_nym,
                                         nd.ip, nd.port, nd.client_port, blskey=blskey,
                                         bls_key_proof=key_proof,
-                                        seq_no=seq_no,
+                                        seq_no=poolLedger.next_seq_no,
                                         protocol_version=genesis_protocol_version)
             
-            seq_no +=1
             poolLedger.add(node_txn)
         
         poolLedger.stop()
         domainLedger.stop()
+        manifest_path = cls.write_genesis_manifest(genesis_dir, [poolLedger, domainLedger])
+        return [poolLedger.file_path, domainLedger.file_path, manifest_path]
+
 
 
 
 
+NodeResources = namedtuple('NodeResources', ['cpu_affinity', 'client_connections_limit'])
 
 NodeDef = namedtuple('NodeDef', ['name', 'ip', 'port', 'client_port', 'idx',
                         'sigseed', 'verkey', 'steward_nym'])
\ No newline at end of file
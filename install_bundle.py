@@ -0,0 +1,54 @@
+"""
+Installs on its host a deployment bundle written by indy_network.py --bundles.
+
+The bundle, a directory or a .tar.gz file, is extracted to / and the network
+name it carries is set in the indy config, as indy_network.py --nodeNum does
+on a host set up without bundles.
+"""
+import argparse
+import os
+import shutil
+import tarfile
+
+from indy_common.config_util import getConfig
+
+from indy_network import NetworkSetup, INDY_CONFIG_FILE, BUNDLE_NETWORK_FILE
+
+INSTALL_ROOT = '/'
+
+
+def extract_bundle(bundle):
+    if os.path.isdir(bundle):
+        for dir_path, _, file_names in os.walk(bundle):
+            target_dir = os.path.join(INSTALL_ROOT, os.path.relpath(dir_path, bundle))
+            os.makedirs(target_dir, exist_ok=True)
+            for file_name in file_names:
+                shutil.copy2(os.path.join(dir_path, file_name), os.path.join(target_dir, file_name))
+    else:
+        with tarfile.open(bundle) as tar:
+            tar.extractall(INSTALL_ROOT)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Install a deployment bundle of indy_network.py on this host')
+    parser.add_argument('bundle', type=str,
+                        help="bundle of this host, a directory or a .tar.gz file")
+    parser.add_argument('--configFile', required=False, type=str, default=INDY_CONFIG_FILE,
+                        help="indy config file to set the network name in (default {})".format(INDY_CONFIG_FILE))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.bundle):
+        parser.error("No such file or directory: {}".format(args.bundle))
+
+    extract_bundle(args.bundle)
+    network_file = os.path.join(getConfig().GENERAL_CONFIG_DIR, BUNDLE_NETWORK_FILE)
+    try:
+        with open(network_file) as f:
+            network = f.read().strip()
+    except FileNotFoundError:
+        parser.error("{} has no network name, it was written by an older indy_network.py".format(args.bundle))
+    NetworkSetup.write_network_name(args.configFile, network)
+    print("Installed {} for network {}".format(args.bundle, network))
+
+# Usages:
+# python3 install_bundle.py bundles/10.0.0.1.tar.gz
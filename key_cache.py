@@ -0,0 +1,115 @@
+"""
+Content-addressed on-disk cache of keys derived from seeds.
+
+Every entry lives in its own file named by sha256(kind, seed) and carries a
+checksum over the name and the cached value, so an entry that got corrupted
+or was copied under a different name is dropped instead of being returned.
+"""
+import hashlib
+import json
+import os
+
+DEFAULT_KEY_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class KeyCache:
+
+    def __init__(self, cache_dir, max_size=DEFAULT_KEY_CACHE_SIZE):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _key(kind, seed):
+        if isinstance(seed, str):
+            seed = seed.encode()
+        return hashlib.sha256(kind.encode() + b':' + seed).hexdigest()
+
+    @staticmethod
+    def _checksum(key, value):
+        data = json.dumps(value, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256((key + data).encode()).hexdigest()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return {'bytes': value.hex()}
+        return {'strs': list(value)}
+
+    @staticmethod
+    def _decode(value):
+        if 'bytes' in value:
+            return bytes.fromhex(value['bytes'])
+        return tuple(value['strs'])
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, kind, seed):
+        key = self._key(kind, seed)
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            if entry['checksum'] != self._checksum(key, entry['value']):
+                raise ValueError('checksum mismatch')
+            value = self._decode(entry['value'])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            # Corrupted entry, it will be derived and written again
+            self._remove(path)
+            return None
+
+        # Keep recently used entries away from eviction
+        os.utime(path)
+        return value
+
+    def put(self, kind, seed, value):
+        key = self._key(kind, seed)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        value = self._encode(value)
+        entry = {'value': value, 'checksum': self._checksum(key, value)}
+
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size bytes
+        of disk space. Entries are small files that take at least a block each,
+        so the space they use is counted, not their size. It walks the whole
+        cache, so it is meant to be called once per run.
+        """
+        entries = []
+        total_size = 0
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size = st.st_blocks * 512
+                entries.append((st.st_mtime, size, path))
+                total_size += size
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            self._remove(path)
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,228 @@
+"""
+Starts all the local nodes of the pool genesis as child processes of
+start_indy_node.py and waits until they are ready.
+
+A node is ready when it has written its <name>_info.json (the file
+validator_info.py reads) after being started and reports the participating
+mode there. Nodes write that file DUMP_VALIDATOR_INFO_PERIOD_SEC apart, so
+the time-to-ready measured here is as precise as that period.
+The nodes keep running until the launcher is interrupted, then they are
+stopped with SIGTERM, and SIGKILL if they do not exit in time.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from indy_common.config_helper import ConfigHelper
+from indy_common.config_util import getConfig
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+from plenum.common.constants import NODE, DATA, ALIAS, NODE_IP, NODE_PORT, CLIENT_IP, CLIENT_PORT
+from plenum.common.txn_util import get_type, get_payload_data
+
+from indy_network import NetworkSetup
+
+START_NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'start_indy_node.py')
+READY_MODE = 'participating'
+POLL_INTERVAL = 0.5
+
+
+def is_local(ip):
+    if ip == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(ip).is_loopback
+    except ValueError:
+        return False
+
+
+def read_pool_nodes(pool_file):
+    nodes = []
+    with open(pool_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            txn = json.loads(line)
+            if get_type(txn) != NODE:
+                continue
+            data = get_payload_data(txn)[DATA]
+            nodes.append((data[ALIAS], data[NODE_IP], data[NODE_PORT], data[CLIENT_IP], data[CLIENT_PORT]))
+    return nodes
+
+
+def read_env_file(path):
+    # Node params files are plain KEY=VALUE lines
+    env = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                key, sep, value = line.strip().partition('=')
+                if sep:
+                    env[key] = value
+    return env
+
+
+def node_env(config, nodeParamsFileName, name):
+    # Co-located nodes get their own params file, see NetworkSetup.node_params_file_name
+    env = dict(os.environ)
+    params = read_env_file(os.path.join(config.GENERAL_CONFIG_DIR, '{}_{}'.format(name, nodeParamsFileName)))
+    if 'NODE_CPU_AFFINITY' in params:
+        env['NODE_CPU_AFFINITY'] = params['NODE_CPU_AFFINITY']
+    return env
+
+
+def read_node_mode(info_file, started_at):
+    # Only files written after the node was started count
+    try:
+        if os.stat(info_file).st_mtime < started_at:
+            return None
+        with open(info_file) as f:
+            info = json.load(f)
+        return str(info['Node_info'].get('Mode', '')).lower()
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        # Missing or only partially written yet
+        return None
+
+
+class LocalPool:
+
+    def __init__(self, config, nodes, log_dir, nodeParamsFileName, node_port_offset=0):
+        self.config = config
+        self.nodes = nodes
+        self.log_dir = log_dir
+        self.nodeParamsFileName = nodeParamsFileName
+        # With net_relay.py the genesis ports belong to the relay
+        self.node_port_offset = node_port_offset
+        self.info_dir = ConfigHelper(config).node_info_dir
+        self.processes = {}
+        self.log_files = {}
+        self.started_at = None
+        self.ready_after = {}
+
+    def start(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.started_at = time.time()
+        for name, nIp, nPort, cIp, cPort in self.nodes:
+            nPort += self.node_port_offset
+            log_file = open(os.path.join(self.log_dir, '{}.log'.format(name)), 'ab')
+            self.log_files[name] = log_file
+            # A session of its own, so that Ctrl-C only reaches the launcher
+            # and the nodes are stopped in order by stop()
+            self.processes[name] = subprocess.Popen(
+                [sys.executable, START_NODE_SCRIPT, name, nIp, str(nPort), cIp, str(cPort)],
+                stdout=log_file, stderr=subprocess.STDOUT,
+                env=node_env(self.config, self.nodeParamsFileName, name),
+                start_new_session=True)
+            print("Started {} (pid {}) on {}:{}, client {}:{}".format(
+                name, self.processes[name].pid, nIp, nPort, cIp, cPort))
+
+    def info_file(self, name):
+        return os.path.join(self.info_dir, '{}_info.json'.format(name.lower()))
+
+    def exited(self):
+        return {name: p.returncode for name, p in self.processes.items() if p.poll() is not None}
+
+    def wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while len(self.ready_after) < len(self.processes):
+            for name in self.processes:
+                if name not in self.ready_after and \
+                        read_node_mode(self.info_file(name), self.started_at) == READY_MODE:
+                    self.ready_after[name] = time.time() - self.started_at
+                    print("{} is ready after {:.1f}s".format(name, self.ready_after[name]))
+
+            exited = self.exited()
+            if exited:
+                for name, code in sorted(exited.items()):
+                    print("{} exited with code {}, see {}".format(
+                        name, code, os.path.join(self.log_dir, '{}.log'.format(name))))
+                return False
+            if time.time() > deadline:
+                print("Not ready after {}s: {}".format(
+                    timeout, ', '.join(sorted(set(self.processes) - set(self.ready_after)))))
+                return False
+            time.sleep(POLL_INTERVAL)
+
+        print("Pool of {} nodes is ready after {:.1f}s".format(len(self.processes), max(self.ready_after.values())))
+        return True
+
+    def stop(self, timeout):
+        for name, p in self.processes.items():
+            if p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+        deadline = time.time() + timeout
+        for name, p in self.processes.items():
+            try:
+                p.wait(max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                print("{} did not stop in {}s, killing it".format(name, timeout))
+                p.kill()
+                p.wait()
+        for log_file in self.log_files.values():
+            log_file.close()
+        print("Pool stopped")
+
+
+def select_nodes(pool_nodes, names):
+    if names:
+        by_name = {node[0]: node for node in pool_nodes}
+        unknown = [name for name in names if name not in by_name]
+        if unknown:
+            raise ValueError("Not in the pool genesis: {}".format(', '.join(unknown)))
+        return [by_name[name] for name in names]
+    return [node for node in pool_nodes if is_local(node[1])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Start the local nodes of the pool and wait until they are ready')
+    parser.add_argument('--nodeNames', nargs='+', required=False,
+                        help="nodes to start (all nodes of the pool genesis with a loopback IP by default)")
+    parser.add_argument('--nodeParamsFileName', required=False, type=str, default='indy.env',
+                        help="name of the node params files (default indy.env)")
+    parser.add_argument('--logDir', required=False, type=str, default='local_pool_logs',
+                        help="directory for the output of the nodes (default local_pool_logs)")
+    parser.add_argument('--readyTimeout', required=False, type=float, default=300,
+                        help="seconds to wait for the pool to be ready (default 300)")
+    parser.add_argument('--stopTimeout', required=False, type=float, default=30,
+                        help="seconds to wait for the nodes to exit before killing them (default 30)")
+    parser.add_argument('--relayPortOffset', required=False, type=int, default=0,
+                        help="start the node stacks on their genesis port plus this offset, "
+                             "for net_relay.py to listen on the genesis ports (default 0)")
+    parser.add_argument('--exitWhenReady', action='store_true',
+                        help="stop the pool as soon as it is ready, e.g. to measure startup time")
+    args = parser.parse_args()
+
+    config = getConfig()
+    pool_file = genesis_txn_path(ConfigHelper(config).genesis_dir, NetworkSetup.pool_ledger_file_name(config))
+    try:
+        nodes = select_nodes(read_pool_nodes(pool_file), args.nodeNames)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if not nodes:
+        parser.error("No local nodes in {}".format(pool_file))
+
+    pool = LocalPool(config, nodes, args.logDir, args.nodeParamsFileName, args.relayPortOffset)
+    # SIGTERM stops the pool the same way as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    ready = False
+    try:
+        pool.start()
+        ready = pool.wait_ready(args.readyTimeout)
+        if ready and not args.exitWhenReady:
+            print("Press Ctrl-C to stop the pool")
+            while not pool.exited():
+                time.sleep(POLL_INTERVAL)
+            print("Stopping the pool, some nodes exited: {}".format(pool.exited()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop(args.stopTimeout)
+    sys.exit(0 if ready else 1)
+
+# Usages:
+# python3 launch_local_pool.py
+# python3 launch_local_pool.py --nodeNames Node1 Node2 Node3 Node4 --exitWhenReady
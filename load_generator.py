@@ -0,0 +1,305 @@
+"""
+Open-loop write/read load against a pool, sent by the Client1..N identities
+registered in the domain genesis by indy_network.py.
+
+Requests are started at a fixed rate whether or not earlier ones have been
+answered, and latency is measured from the time a request was scheduled,
+so a saturated pool shows up as growing latency instead of a lower rate.
+Writes are ATTRIB and NYM (verkey of the client itself) txns, reads are
+GET_ATTRIB and GET_NYM. Throughput and p50/p95/p99 latency are printed
+per interval and for the whole run.
+
+Requires the indy-sdk python wrapper (python3-indy).
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+
+from indy import did, ledger, pool, wallet
+from indy.error import IndyError
+
+from indy_common.config_helper import ConfigHelper
+from indy_common.config_util import getConfig
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+
+from indy_network import NetworkSetup
+
+PROTOCOL_VERSION = 2
+DEFAULT_MIX = 'attrib=0.4,nym=0.1,get_attrib=0.25,get_nym=0.25'
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class LatencyStats:
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+
+    def add(self, op, latency, ok):
+        if ok:
+            self.latencies[op].append(latency)
+        else:
+            self.errors[op] += 1
+
+    def summary(self, elapsed):
+        result = collections.OrderedDict()
+        all_latencies = []
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[op])
+            all_latencies += latencies
+            result[op] = self.op_summary(latencies, self.errors[op], elapsed)
+        result['total'] = self.op_summary(sorted(all_latencies), sum(self.errors.values()), elapsed)
+        return result
+
+    @staticmethod
+    def op_summary(latencies, errors, elapsed):
+        summary = collections.OrderedDict([
+            ('ok', len(latencies)),
+            ('errors', errors),
+            ('throughput', len(latencies) / elapsed if elapsed else 0.0),
+        ])
+        for p in PERCENTILES:
+            value = percentile(latencies, p)
+            summary['p{}_ms'.format(p)] = None if value is None else value * 1000
+        return summary
+
+
+def format_summary(summary):
+    lines = []
+    for op, s in summary.items():
+        latencies = ' '.join('p{}={}'.format(p, 'n/a' if s['p{}_ms'.format(p)] is None
+                                             else '{:.1f}ms'.format(s['p{}_ms'.format(p)]))
+                             for p in PERCENTILES)
+        lines.append("  {:<10} {:>8.1f} txn/s  ok={:<7} errors={:<5} {}".format(
+            op, s['throughput'], s['ok'], s['errors'], latencies))
+    return '\n'.join(lines)
+
+
+def is_reply(response):
+    return json.loads(response).get('op') == 'REPLY'
+
+
+async def write_attrib(pool_handle, wallet_handle, client_did, client_verkey, seq_no):
+    request = await ledger.build_attrib_request(client_did, client_did, None, json.dumps({'load': seq_no}), None)
+    return is_reply(await ledger.sign_and_submit_request(pool_handle, wallet_handle, client_did, request))
+
+
+async def write_nym(pool_handle, wallet_handle, client_did, client_verkey, seq_no):
+    # Clients are identity owners, the only NYM they may send is one for their own DID
+    request = await ledger.build_nym_request(client_did, client_did, client_verkey, None, None)
+    return is_reply(await ledger.sign_and_submit_request(pool_handle, wallet_handle, client_did, request))
+
+
+async def read_attrib(pool_handle, wallet_handle, client_did, client_verkey, seq_no):
+    request = await ledger.build_get_attrib_request(client_did, client_did, 'load', None, None)
+    return is_reply(await ledger.submit_request(pool_handle, request))
+
+
+async def read_nym(pool_handle, wallet_handle, client_did, client_verkey, seq_no):
+    request = await ledger.build_get_nym_request(client_did, client_did)
+    return is_reply(await ledger.submit_request(pool_handle, request))
+
+
+OPERATIONS = collections.OrderedDict([
+    ('attrib', write_attrib),
+    ('nym', write_nym),
+    ('get_attrib', read_attrib),
+    ('get_nym', read_nym),
+])
+
+
+class OperationMix(collections.OrderedDict):
+    def __str__(self):
+        return ','.join('{}={}'.format(op, weight) for op, weight in self.items())
+
+
+def _type_mix(value):
+    mix = OperationMix()
+    for part in value.split(','):
+        op, sep, weight = part.partition('=')
+        op = op.strip()
+        if op not in OPERATIONS or not sep:
+            raise argparse.ArgumentTypeError(
+                "expected op=weight pairs with ops from {}, got {!r}".format(', '.join(OPERATIONS), part))
+        try:
+            mix[op] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError("{!r} is not a valid weight".format(weight))
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("at least one weight should be > 0")
+    return mix
+
+
+class LoadGenerator:
+
+    def __init__(self, genesis_file, client_count, rate, duration, mix, interval, output):
+        self.genesis_file = genesis_file
+        self.client_count = client_count
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.interval = interval
+        self.output = output
+        self.name = 'load_generator_{}'.format(os.getpid())
+        self.pool_handle = None
+        self.wallet_handle = None
+        self.wallet_config = json.dumps({'id': self.name})
+        self.wallet_credentials = None
+        self.clients = []
+        self.in_flight = 0
+        self.started_at = None
+        self.pool_created = False
+        self.total_stats = LatencyStats()
+        self.interval_stats = LatencyStats()
+
+    async def open(self):
+        await pool.set_protocol_version(PROTOCOL_VERSION)
+        await pool.create_pool_ledger_config(self.name, json.dumps({'genesis_txn': self.genesis_file}))
+        self.pool_created = True
+        self.pool_handle = await pool.open_pool_ledger(self.name, None)
+
+        # Throwaway wallet, a raw key skips the slow key derivation
+        self.wallet_credentials = json.dumps({'key': await wallet.generate_wallet_key(None),
+                                              'key_derivation_method': 'RAW'})
+        await wallet.create_wallet(self.wallet_config, self.wallet_credentials)
+        self.wallet_handle = await wallet.open_wallet(self.wallet_config, self.wallet_credentials)
+
+        for idx in range(1, self.client_count + 1):
+            seed = NetworkSetup.get_signing_seed("Client" + str(idx)).decode()
+            client_did, client_verkey = await did.create_and_store_my_did(self.wallet_handle,
+                                                                           json.dumps({'seed': seed}))
+            self.clients.append((client_did, client_verkey))
+        print("Opened pool {} with {} clients".format(self.genesis_file, len(self.clients)))
+
+    async def close(self):
+        if self.wallet_handle is not None:
+            await wallet.close_wallet(self.wallet_handle)
+            await wallet.delete_wallet(self.wallet_config, self.wallet_credentials)
+        if self.pool_handle is not None:
+            await pool.close_pool_ledger(self.pool_handle)
+        if self.pool_created:
+            await pool.delete_pool_ledger_config(self.name)
+
+    async def send(self, op, client, seq_no, scheduled_at):
+        self.in_flight += 1
+        try:
+            ok = await OPERATIONS[op](self.pool_handle, self.wallet_handle, client[0], client[1], seq_no)
+        except IndyError:
+            ok = False
+        finally:
+            self.in_flight -= 1
+        # Answers count in the interval they arrive in
+        latency = time.perf_counter() - scheduled_at
+        self.total_stats.add(op, latency, ok)
+        self.interval_stats.add(op, latency, ok)
+
+    def report_interval(self, since, now):
+        summary = self.interval_stats.summary(now - since)
+        self.interval_stats = LatencyStats()
+        print("[{:>7.1f}s] in flight {}\n{}".format(now - self.started_at, self.in_flight, format_summary(summary)))
+        if self.output:
+            self.output.write(json.dumps({'time': now - self.started_at, 'in_flight': self.in_flight,
+                                          'stats': summary}) + '\n')
+            self.output.flush()
+
+    async def run(self):
+        ops = list(self.mix)
+        weights = [self.mix[op] for op in ops]
+        clients = itertools.cycle(self.clients)
+        tasks = set()
+
+        self.started_at = time.perf_counter()
+        interval_start = self.started_at
+        total = int(self.rate * self.duration)
+        for seq_no in range(total):
+            scheduled_at = self.started_at + seq_no / self.rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = time.perf_counter()
+            if now - interval_start >= self.interval:
+                self.report_interval(interval_start, now)
+                interval_start = now
+
+            op = random.choices(ops, weights)[0]
+            task = asyncio.ensure_future(self.send(op, next(clients), seq_no, scheduled_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        sent_for = time.perf_counter() - self.started_at
+        if tasks:
+            await asyncio.wait(tasks)
+        now = time.perf_counter()
+        self.report_interval(interval_start, now)
+
+        summary = self.total_stats.summary(now - self.started_at)
+        print("Sent {} requests in {:.1f}s ({:.1f} req/s offered), all answered after {:.1f}s\n{}".format(
+            total, sent_for, total / sent_for if sent_for else 0.0, now - self.started_at, format_summary(summary)))
+        if self.output:
+            self.output.write(json.dumps({'time': now - self.started_at, 'offered_rate': self.rate,
+                                          'mix': str(self.mix), 'clients': len(self.clients),
+                                          'total': summary}) + '\n')
+        return summary
+
+
+async def main(args, genesis_file, output):
+    generator = LoadGenerator(genesis_file, args.clients, args.rate, args.duration, args.mix, args.interval, output)
+    try:
+        await generator.open()
+        await generator.run()
+    finally:
+        await generator.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Send open-loop load to a pool from the genesis clients')
+    parser.add_argument('--clients', required=True, type=NetworkSetup._bootstrap_args_type_node_count,
+                        help="number of genesis clients (Client1..N) sending requests")
+    parser.add_argument('--rate', required=False, type=float, default=10,
+                        help="requests per second started, whether answered or not (default 10)")
+    parser.add_argument('--duration', required=False, type=float, default=60,
+                        help="seconds to send requests for (default 60)")
+    parser.add_argument('--mix', required=False, type=_type_mix, default=_type_mix(DEFAULT_MIX),
+                        help="relative weights of {} (default {})".format(', '.join(OPERATIONS), DEFAULT_MIX))
+    parser.add_argument('--interval', required=False, type=float, default=10,
+                        help="seconds between reports (default 10)")
+    parser.add_argument('--genesisFile', required=False, type=str,
+                        help="pool genesis file (the network's one by default)")
+    parser.add_argument('--output', required=False, type=str,
+                        help="append the per-interval and total stats to this file as JSON lines")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.duration <= 0 or args.interval <= 0:
+        parser.error("--rate, --duration and --interval should be > 0")
+
+    config = getConfig()
+    genesis_file = args.genesisFile or genesis_txn_path(ConfigHelper(config).genesis_dir,
+                                                        NetworkSetup.pool_ledger_file_name(config))
+
+    output = open(args.output, 'a') if args.output else None
+    try:
+        asyncio.get_event_loop().run_until_complete(main(args, genesis_file, output))
+    except KeyboardInterrupt:
+        sys.exit(1)
+    finally:
+        if output:
+            output.close()
+
+# Usages:
+# python3 load_generator.py --clients 100 --rate 50 --duration 120
+# python3 load_generator.py --clients 10 --rate 20 --mix attrib=1,get_nym=1 --output load.jsonl
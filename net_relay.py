@@ -0,0 +1,284 @@
+"""
+Userspace TCP relay putting WAN-like links between the nodes of a local pool.
+
+The relay listens on the node stack ports of the pool genesis, and forwards
+to the nodes, which are started on those ports plus an offset
+(launch_local_pool.py --relayPortOffset). The node sending is found from the
+source port of the connection through /proc, which works without root for
+processes of the same user, so every (source, destination) link can have its
+own one-way delay, jitter, bandwidth and loss, read from a topology file:
+
+    {
+        "default": {"delay_ms": 1},
+        "regions": {"Node1": "eu-west", "Node2": "eu-west", "Node3": "us-east", "Node4": "ap-south"},
+        "links": [
+            {"a": "eu-west", "b": "us-east", "delay_ms": 45, "jitter_ms": 5, "bandwidth_mbps": 100},
+            {"a": "eu-west", "b": "ap-south", "delay_ms": 120, "jitter_ms": 10, "loss": 0.01},
+            {"a": "Node1", "b": "Node2", "delay_ms": 0.5}
+        ]
+    }
+
+Links are symmetric and looked up by node pair, then region pair, then
+"default". Loss can't drop bytes of a TCP stream, it delays the chunk by a
+retransmission timeout instead, which is what a lost segment costs TCP.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+from collections import namedtuple
+
+from indy_common.config_helper import ConfigHelper
+from indy_common.config_util import getConfig
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+
+from indy_network import NetworkSetup
+from launch_local_pool import read_pool_nodes, is_local
+
+READ_SIZE = 64 * 1024
+PIPE_QUEUE_SIZE = 256
+TCP_SEGMENT_SIZE = 1448
+MIN_RETRANSMIT_TIMEOUT_MS = 200
+START_NODE_SCRIPT_NAME = 'start_indy_node.py'
+
+Link = namedtuple('Link', ['delay_ms', 'jitter_ms', 'bandwidth_mbps', 'loss'])
+NO_LINK = Link(delay_ms=0.0, jitter_ms=0.0, bandwidth_mbps=0.0, loss=0.0)
+
+
+def parse_link(name, params):
+    unknown = set(params) - set(Link._fields)
+    if unknown:
+        raise ValueError("link {}: unknown parameters {}, expected some of {}".format(
+            name, ', '.join(sorted(unknown)), ', '.join(Link._fields)))
+    link = NO_LINK._replace(**{k: float(v) for k, v in params.items()})
+    if min(link) < 0 or link.loss >= 1:
+        raise ValueError("link {}: parameters should be >= 0 and loss < 1".format(name))
+    return link
+
+
+class Topology:
+
+    def __init__(self, default=NO_LINK, regions=None, links=None):
+        self.default = default
+        self.regions = regions or {}
+        self.links = links or {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        links = {}
+        for params in data.get('links', []):
+            params = dict(params)
+            ends = (params.pop('a', None), params.pop('b', None))
+            if None in ends:
+                raise ValueError("link {}: expected \"a\" and \"b\" with node or region names".format(
+                    json.dumps(params)))
+            links[frozenset(ends)] = parse_link('{} - {}'.format(*ends), params)
+        return cls(parse_link('default', data.get('default', {})), data.get('regions', {}), links)
+
+    def link(self, src, dst):
+        if src is None:
+            return self.default
+        for key in (frozenset((src, dst)),
+                    frozenset((self.regions.get(src, src), self.regions.get(dst, dst)))):
+            if key in self.links:
+                return self.links[key]
+        return self.default
+
+
+def _socket_inode(local_port, remote_port):
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if int(fields[1].rsplit(':', 1)[1], 16) == local_port and \
+                            int(fields[2].rsplit(':', 1)[1], 16) == remote_port:
+                        return fields[9]
+        except OSError:
+            continue
+    return None
+
+
+def node_processes():
+    nodes = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+                args = f.read().decode(errors='replace').split('\0')
+        except OSError:
+            continue
+        for i, arg in enumerate(args[:-1]):
+            if os.path.basename(arg) == START_NODE_SCRIPT_NAME:
+                nodes[pid] = args[i + 1]
+                break
+    return nodes
+
+
+def find_source_node(peer_port, listen_port):
+    """
+    Name of the node owning the connecting socket, None for anything else.
+    """
+    inode = _socket_inode(peer_port, listen_port)
+    if inode is None:
+        return None
+    target = 'socket:[{}]'.format(inode)
+    for pid, name in node_processes().items():
+        fd_dir = '/proc/{}/fd'.format(pid)
+        try:
+            for fd in os.listdir(fd_dir):
+                if os.readlink(os.path.join(fd_dir, fd)) == target:
+                    return name
+        except OSError:
+            continue
+    return None
+
+
+class ShapedPipe:
+    """
+    One direction of a relayed connection: chunks are delivered in order,
+    after being serialized at the link bandwidth and delayed.
+    """
+
+    def __init__(self, reader, writer, link):
+        self.reader = reader
+        self.writer = writer
+        self.link = link
+        self.queue = asyncio.Queue(maxsize=PIPE_QUEUE_SIZE)
+        self.link_free_at = 0.0
+        self.last_deliver_at = 0.0
+
+    def deliver_at(self, now, size):
+        link = self.link
+        tx_time = size * 8 / (link.bandwidth_mbps * 1e6) if link.bandwidth_mbps else 0.0
+        self.link_free_at = max(now, self.link_free_at) + tx_time
+
+        delay_ms = link.delay_ms
+        if link.jitter_ms:
+            delay_ms = max(0.0, delay_ms + random.gauss(0, link.jitter_ms))
+        if link.loss:
+            segments = math.ceil(size / TCP_SEGMENT_SIZE)
+            if random.random() < 1 - (1 - link.loss) ** segments:
+                delay_ms += max(MIN_RETRANSMIT_TIMEOUT_MS, 2 * link.delay_ms)
+
+        self.last_deliver_at = max(self.link_free_at + delay_ms / 1000, self.last_deliver_at)
+        return self.last_deliver_at
+
+    async def _receive(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                data = await self.reader.read(READ_SIZE)
+                if not data:
+                    break
+                await self.queue.put((self.deliver_at(loop.time(), len(data)), data))
+        except ConnectionError:
+            pass
+        await self.queue.put((None, None))
+
+    async def _send(self):
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                deliver_at, data = await self.queue.get()
+                if data is None:
+                    break
+                delay = deliver_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.writer.write(data)
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    async def run(self):
+        await asyncio.gather(self._receive(), self._send())
+
+
+class NodeRelay:
+
+    def __init__(self, name, listen, target, topology):
+        self.name = name
+        self.listen = listen
+        self.target = target
+        self.topology = topology
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_event_loop()
+        peer_port = writer.get_extra_info('peername')[1]
+        src = await loop.run_in_executor(None, find_source_node, peer_port, self.listen[1])
+        link = self.topology.link(src, self.name)
+        try:
+            target_reader, target_writer = await asyncio.open_connection(*self.target)
+        except OSError as exc:
+            print("{} -> {}: {}".format(src or 'unknown', self.name, exc))
+            writer.close()
+            return
+
+        self.connections += 1
+        print("{} -> {}: delay {}ms jitter {}ms bandwidth {} loss {}".format(
+            src or 'unknown', self.name, link.delay_ms, link.jitter_ms,
+            '{}Mbit/s'.format(link.bandwidth_mbps) if link.bandwidth_mbps else 'unlimited', link.loss))
+        await asyncio.gather(ShapedPipe(reader, target_writer, link).run(),
+                             ShapedPipe(target_reader, writer, link).run())
+
+    async def start(self):
+        return await asyncio.start_server(self.handle, *self.listen)
+
+
+def plan_relays(pool_nodes, port_offset, topology):
+    genesis_ports = {port for node in pool_nodes for port in (node[2], node[4])}
+    relays = []
+    for name, nIp, nPort, cIp, cPort in pool_nodes:
+        if not is_local(nIp):
+            continue
+        if nPort + port_offset in genesis_ports or nPort + port_offset > 65535:
+            raise ValueError("{}: port {} + offset {} collides with the genesis ports".format(
+                name, nPort, port_offset))
+        relays.append(NodeRelay(name, (nIp, nPort), (nIp, nPort + port_offset), topology))
+    return relays
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Relay the node stacks of the local pool over emulated WAN links')
+    parser.add_argument('--topology', required=False, type=str,
+                        help="JSON file with the delay, jitter, bandwidth and loss of the links "
+                             "(no shaping by default)")
+    parser.add_argument('--relayPortOffset', required=False, type=int, default=1000,
+                        help="node stacks listen on their genesis port plus this offset (default 1000)")
+    parser.add_argument('--genesisFile', required=False, type=str,
+                        help="pool genesis file (the network's one by default)")
+    args = parser.parse_args()
+
+    config = getConfig()
+    genesis_file = args.genesisFile or genesis_txn_path(ConfigHelper(config).genesis_dir,
+                                                        NetworkSetup.pool_ledger_file_name(config))
+    try:
+        topology = Topology.load(args.topology) if args.topology else Topology()
+        relays = plan_relays(read_pool_nodes(genesis_file), args.relayPortOffset, topology)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    if not relays:
+        parser.error("No local nodes in {}".format(genesis_file))
+
+    loop = asyncio.get_event_loop()
+    for relay in relays:
+        loop.run_until_complete(relay.start())
+        print("Relaying {}:{} to {} at {}:{}".format(relay.listen[0], relay.listen[1], relay.name, *relay.target))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+# Usages:
+# python3 net_relay.py --topology wan.json
+# python3 launch_local_pool.py --relayPortOffset 1000
@@ -0,0 +1,78 @@
+"""
+Latency-aware ordering of the NODE txns in the pool genesis.
+
+The order of the pool ledger decides the primary rotation: the master primary
+of view v is the node at position v % n. The expected 3PC latency of a view
+is estimated from measured RTTs between hosts as the time the primary needs
+to hear from a quorum of n - f nodes, and views are weighted by the chance
+that the pool gets that far, decay ** v. Sorting the nodes by their quorum
+latency minimizes that weighted sum.
+"""
+import csv
+import json
+
+
+def load_latency_matrix(path):
+    """
+    Read RTTs in milliseconds between hosts, either as JSON
+    {"host1": {"host2": rtt, ...}, ...} or as CSV lines "host1,host2,rtt".
+    Returns {(host1, host2): rtt}, filled in symmetrically.
+    """
+    rtts = {}
+    with open(path) as f:
+        if path.endswith('.json'):
+            try:
+                data = json.load(f)
+                for src, dsts in data.items():
+                    for dst, rtt in dsts.items():
+                        rtts[(src, dst)] = float(rtt)
+            except (ValueError, AttributeError) as exc:
+                raise ValueError("{}: expected {{host: {{host: rtt}}}}: {}".format(path, exc))
+        else:
+            for line_no, row in enumerate(csv.reader(f), start=1):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    src, dst, rtt = (x.strip() for x in row)
+                    rtts[(src, dst)] = float(rtt)
+                except ValueError:
+                    raise ValueError("{}:{}: expected 'host1,host2,rtt'".format(path, line_no))
+
+    for (src, dst), rtt in list(rtts.items()):
+        rtts.setdefault((dst, src), rtt)
+    return rtts
+
+
+def rtt_between(rtts, src, dst):
+    if src == dst:
+        return rtts.get((src, dst), 0.0)
+    try:
+        return rtts[(src, dst)]
+    except KeyError:
+        raise ValueError("No RTT between {} and {} in the latency matrix".format(src, dst))
+
+
+def quorum_latency(primary_host, hosts, rtts):
+    n = len(hosts)
+    f = (n - 1) // 3
+    latencies = sorted(rtt_between(rtts, primary_host, host) for host in hosts)
+    return latencies[n - f - 1]
+
+
+def rotation_cost(latencies, decay):
+    weights = [decay ** v for v in range(len(latencies))]
+    return sum(w * latency for w, latency in zip(weights, latencies)) / sum(weights)
+
+
+def order_nodes(node_defs, rtts, decay=0.5):
+    """
+    Returns the node defs in the order minimizing the expected primary latency,
+    with the predicted cost of that order and of the original one.
+    """
+    hosts = [nd.ip for nd in node_defs]
+    latencies = {nd.idx: quorum_latency(nd.ip, hosts, rtts) for nd in node_defs}
+
+    ordered = sorted(node_defs, key=lambda nd: (latencies[nd.idx], nd.idx))
+    cost = rotation_cost([latencies[nd.idx] for nd in ordered], decay)
+    default_cost = rotation_cost([latencies[nd.idx] for nd in node_defs], decay)
+    return ordered, latencies, cost, default_cost
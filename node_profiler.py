@@ -0,0 +1,142 @@
+"""
+Opt-in profiling of a running node, configured by environment variables
+the same way as NODE_CPU_AFFINITY:
+
+    NODE_PROFILE           comma separated modes: sample, cprofile, tracemalloc
+    NODE_PROFILE_DIR       output directory, a sub directory per node (default ./node_profiles)
+    NODE_PROFILE_INTERVAL  seconds between dumps, 0 for on demand only (default 60)
+    NODE_PROFILE_SAMPLE_HZ stack samples per second of the sample mode (default 100)
+    NODE_PROFILE_FRAMES    frames kept per allocation by tracemalloc (default 25)
+
+Every dump covers the time since the previous one. sample writes folded
+stacks of the main thread (flamegraph.pl / speedscope input), cprofile
+writes pstats files and tracemalloc writes snapshots for
+tracemalloc.Snapshot.load. SIGUSR1 dumps on demand, periodic dumps raise
+it too, so that cProfile is always switched in the main thread.
+"""
+import atexit
+import collections
+import cProfile
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_MODES = ('sample', 'cprofile', 'tracemalloc')
+DEFAULT_PROFILE_DIR = 'node_profiles'
+DEFAULT_PROFILE_INTERVAL = 60
+DEFAULT_SAMPLE_HZ = 100
+DEFAULT_TRACEMALLOC_FRAMES = 25
+
+
+class StackSampler:
+
+    def __init__(self, thread_id, hz):
+        self.thread_id = thread_id
+        self.period = 1.0 / hz
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def folded(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self):
+        while not self.stopped.wait(self.period):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = self.folded(frame)
+                with self.lock:
+                    self.counts[stack] += 1
+
+    def start(self):
+        threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def dump(self, path):
+        with self.lock:
+            counts, self.counts = self.counts, collections.Counter()
+        with open(path, 'w') as f:
+            for stack, count in counts.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class NodeProfiler:
+
+    def __init__(self, name, modes, out_dir, interval, sample_hz=DEFAULT_SAMPLE_HZ,
+                 tracemalloc_frames=DEFAULT_TRACEMALLOC_FRAMES):
+        unknown = set(modes) - set(PROFILE_MODES)
+        if unknown:
+            raise ValueError("Unknown profile modes {}, expected some of {}".format(
+                ', '.join(sorted(unknown)), ', '.join(PROFILE_MODES)))
+        self.name = name
+        self.modes = modes
+        self.out_dir = os.path.join(out_dir, name)
+        self.interval = interval
+        self.sample_hz = sample_hz
+        self.tracemalloc_frames = tracemalloc_frames
+        self.sampler = None
+        self.profile = None
+        self.dump_count = 0
+
+    @classmethod
+    def from_env(cls, name, environ=os.environ):
+        modes = [mode.strip() for mode in environ.get('NODE_PROFILE', '').split(',') if mode.strip()]
+        if not modes:
+            return None
+        return cls(name, modes,
+                   environ.get('NODE_PROFILE_DIR', DEFAULT_PROFILE_DIR),
+                   float(environ.get('NODE_PROFILE_INTERVAL', DEFAULT_PROFILE_INTERVAL)),
+                   float(environ.get('NODE_PROFILE_SAMPLE_HZ', DEFAULT_SAMPLE_HZ)),
+                   int(environ.get('NODE_PROFILE_FRAMES', DEFAULT_TRACEMALLOC_FRAMES)))
+
+    def start(self):
+        # Has to be called from the main thread, which runs the node
+        os.makedirs(self.out_dir, exist_ok=True)
+        if 'tracemalloc' in self.modes:
+            tracemalloc.start(self.tracemalloc_frames)
+        if 'sample' in self.modes:
+            self.sampler = StackSampler(threading.get_ident(), self.sample_hz)
+            self.sampler.start()
+        if 'cprofile' in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        signal.signal(signal.SIGUSR1, self._on_signal)
+        if self.interval > 0:
+            threading.Thread(target=self._tick, name='profile-dumper', daemon=True).start()
+        atexit.register(self.dump)
+        print("Profiling {} ({}), dumps in {}, pid {}".format(
+            self.name, ', '.join(self.modes), self.out_dir, os.getpid()))
+
+    def _tick(self):
+        while True:
+            time.sleep(self.interval)
+            os.kill(os.getpid(), signal.SIGUSR1)
+
+    def _on_signal(self, signum, frame):
+        self.dump()
+
+    def _path(self, mode, ext):
+        return os.path.join(self.out_dir, '{}-{}-{:04d}.{}'.format(
+            mode, time.strftime('%Y%m%d-%H%M%S'), self.dump_count, ext))
+
+    def dump(self):
+        self.dump_count += 1
+        if self.sampler is not None:
+            self.sampler.dump(self._path('sample', 'folded'))
+        if self.profile is not None:
+            # dump_stats stops the profile, a new one covers the next interval
+            profile, self.profile = self.profile, cProfile.Profile()
+            profile.disable()
+            profile.dump_stats(self._path('cprofile', 'prof'))
+            self.profile.enable()
+        if 'tracemalloc' in self.modes:
+            tracemalloc.take_snapshot().dump(self._path('tracemalloc', 'snapshot'))
@@ -0,0 +1,101 @@
+"""
+Wall time, CPU time and peak RSS of the phases of a run,
+reported as JSON, with optional cProfile output for the whole run.
+
+The peak RSS of a phase is the one of this process during the phase, measured
+by resetting the peak at the start of the phase (Linux /proc/self/clear_refs),
+it is null where that is not possible. cumulative_peak_rss_kb is the high-water
+mark of the run so far, worker processes included.
+"""
+import contextlib
+import cProfile
+import json
+import resource
+import time
+
+
+class PhaseTimer:
+
+    def __init__(self, cprofile_path=None):
+        self.phases = []
+        self.cprofile_path = cprofile_path
+        self._profiler = None
+        self._started = time.perf_counter()
+        # Resetting the peak also resets ru_maxrss, so the peaks seen before
+        # every reset are kept here, for the run and for each open phase
+        self._max_rss_kb = 0
+        self._open_phase_peaks = []
+
+    @staticmethod
+    def _cpu_time():
+        # Worker processes of the key derivation pools are accounted as children
+        total = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            total += usage.ru_utime + usage.ru_stime
+        return total
+
+    def _reset_peak_rss(self):
+        try:
+            peak = self._process_peak_rss_kb()
+            self._max_rss_kb = max(self._max_rss_kb, peak)
+            self._open_phase_peaks = [max(open_peak, peak) for open_peak in self._open_phase_peaks]
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+            return True
+        except (OSError, TypeError):
+            return False
+
+    @staticmethod
+    def _process_peak_rss_kb():
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        return None
+
+    def _peak_rss_kb(self):
+        return max(self._max_rss_kb,
+                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    def start_profile(self):
+        if self.cprofile_path and self._profiler is None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop_profile(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.cprofile_path)
+            self._profiler = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = self._cpu_time()
+        peak_reset = self._reset_peak_rss()
+        self._open_phase_peaks.append(0)
+        try:
+            yield
+        finally:
+            phase_peak = self._open_phase_peaks.pop()
+            self.phases.append({
+                'phase': name,
+                'wall_time': time.perf_counter() - wall_start,
+                'cpu_time': self._cpu_time() - cpu_start,
+                'peak_rss_kb': max(phase_peak, self._process_peak_rss_kb()) if peak_reset else None,
+                'cumulative_peak_rss_kb': self._peak_rss_kb(),
+            })
+
+    def report(self):
+        return {
+            'phases': self.phases,
+            'total_wall_time': time.perf_counter() - self._started,
+            'total_cpu_time': self._cpu_time(),
+            'peak_rss_kb': self._peak_rss_kb(),
+        }
+
+    def write_report(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
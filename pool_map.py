@@ -0,0 +1,15 @@
+"""
+Helpers for process pools shared by the scripts.
+"""
+import collections
+
+
+def bounded_map(executor, func, chunks, window):
+    # Like executor.map, but only reads ahead window chunks
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(func, chunk))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
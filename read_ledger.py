@@ -4,9 +4,16 @@ Convenience script for reading a ledger transaction data (stored in leveldb)
 
 """
 import argparse
+import concurrent.futures
+import errno
+import io
 import logging
+import multiprocessing
 import os
 import shutil
+import struct
+import sys
+import tempfile
 
 from pathlib import Path
 
@@ -17,6 +24,8 @@ from plenum.common.constants import HS_ROCKSDB
 from indy_common.config_util import getConfig
 from common.serializers.serialization import ledger_txn_serializer
 
+from pool_map import bounded_map
+
 logging.root.handlers = []
 logger = logging.getLogger()
 logger.propagate = False
@@ -26,6 +35,35 @@ _DATA = 'data'
 # TODO: Replace with constant from config
 postfix = '_transactions'
 
+# leveldb never changes its table files once written, so they can be shared by hard links
+TABLE_SUFFIXES = ('.ldb', '.sst')
+# The lock and the info log of the node are not needed to read
+SKIPPED_FILES = ('LOCK', 'LOG', 'LOG.old')
+SNAPSHOT_ATTEMPTS = 10
+# Snapshots go next to the data dir of the network, not in it, and are named
+# after the pid of their run, so the ones of killed runs can be removed
+READ_COPIES_DIR = 'read_copies'
+READ_COPY_MARK = '-read-copy'
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# --serializer raw: every txn as stored, prefixed with its length
+RAW_LENGTH_PREFIX = struct.Struct('>I')
+# --workers: txns read by a worker at a time
+CHUNK_TXNS = 10000
+
+# leveldb log format (MANIFEST files are logs of version edits)
+LOG_BLOCK_SIZE = 32768
+LOG_HEADER_SIZE = 7
+FULL_FRAGMENT, FIRST_FRAGMENT, MIDDLE_FRAGMENT, LAST_FRAGMENT = 1, 2, 3, 4
+EDIT_COMPARATOR = 1
+EDIT_LOG_NUMBER = 2
+EDIT_NEXT_FILE_NUMBER = 3
+EDIT_LAST_SEQUENCE = 4
+EDIT_COMPACT_POINTER = 5
+EDIT_DELETED_FILE = 6
+EDIT_NEW_FILE = 7
+EDIT_PREV_LOG_NUMBER = 9
+
 
 def read_args():
     parser = argparse.ArgumentParser(
@@ -46,9 +84,15 @@ def read_args():
                         help="returns the number of txns in the given ledger")
     parser.add_argument('--node_name', required=False, help="Node's name")
     parser.add_argument('--serializer', required=False, default='json',
-                        help="How to represent the data (json by default)")
+                        help="How to represent the data (json by default), "
+                             "raw writes the stored msgpack of every txn after its length as a 4 bytes big-endian int")
+    parser.add_argument('--output', required=False,
+                        help="Write the transactions to this file instead of stdout")
     parser.add_argument('--network', required=False, type=str,
                         help="Network name to read ledger from")
+    parser.add_argument('--workers', required=False, type=int, default=1,
+                        help="Processes reading the --frm/--to range, in chunks of {} txns (1 by default)".format(
+                            CHUNK_TXNS))
 
     return parser.parse_args()
 
@@ -63,7 +107,8 @@ def get_ledger_dir(node_name, network):
     else:
         ledger_data_dir = os.path.join(ledger_base_dir, _network, _DATA)
         if os.path.exists(ledger_data_dir):
-            dirs = os.listdir(ledger_data_dir)
+            # Leaving out the read copies older versions made in the data dir
+            dirs = [name for name in os.listdir(ledger_data_dir) if READ_COPY_MARK not in name]
             if len(dirs) == 0:
                 print("Node's 'data' folder not found: {}".format(ledger_data_dir))
                 exit()
@@ -77,7 +122,7 @@ def get_ledger_dir(node_name, network):
     return ledger_data_dir
 
 
-def get_storage(type_, ledger_data_dir):
+def get_storage_name(type_, ledger_data_dir):
     config = getConfig()
 
     storage_name = None
@@ -92,7 +137,11 @@ def get_storage(type_, ledger_data_dir):
     else:
         print("Unknown ledger type: {}".format(type_))
         exit()
+    return storage_name
+
 
+def get_storage(storage_name, ledger_data_dir):
+    config = getConfig()
     return Ledger._defaultStore(dataDir=ledger_data_dir,
                                 logName=storage_name,
                                 ensureDurability=True,
@@ -107,10 +156,25 @@ def get_additional_storages(ledger_data_dir):
     return additional_storages
 
 
-def print_txns(storage, args):
+def open_output(path):
+    # One large buffer for the whole dump instead of a write per print
+    if path:
+        return open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE)
+    sys.stdout.flush()
+    return os.fdopen(os.dup(sys.stdout.fileno()), 'wb', buffering=OUTPUT_BUFFER_SIZE)
+
+
+def print_txns(storage, args, ledger_data_dir, storage_name, copy_storage):
     serializer = None
     if args.serializer == 'json':
         serializer = JsonSerializer()
+    elif args.serializer == 'raw':
+        if args.seq_no or args.count:
+            print("The raw serializer only applies to reading a range of transactions")
+            exit()
+        if not args.output and sys.stdout.isatty():
+            print("Not writing raw transactions to a terminal, use --output or a pipe")
+            exit()
     else:
         print("Unknown serializer for output: {}".format(args.serializer))
         exit()
@@ -128,7 +192,12 @@ def print_txns(storage, args):
         return
 
     # print all (--from --to)
-    print_all(storage, serializer)
+    with open_output(args.output) as output:
+        if args.workers > 1:
+            print_all_parallel(storage, args.serializer, output, args.workers,
+                               ledger_data_dir, storage_name, copy_storage)
+        else:
+            print_all(storage, serializer, output)
 
 
 def print_by_seq_no(storage, seq_no, serializer):
@@ -146,20 +215,260 @@ def print_count(storage):
     print(storage.size)
 
 
-def print_all(storage, serializer):
+def print_all(storage, serializer, output):
     frm = int(args.frm) if args.frm else None
     to = int(args.to) if args.to else None
-    for seqNo, txn in storage.iterator(start=frm, end=to):
-        txn = ledger_txn_serializer.deserialize(txn)
-        print(serializer.serialize(txn, toBytes=False))
+    write_txns(storage.iterator(start=frm, end=to), serializer, output.write)
+
+
+def write_txns(txns, serializer, write):
+    if serializer is None:
+        pack_length = RAW_LENGTH_PREFIX.pack
+        for seqNo, txn in txns:
+            if isinstance(txn, str):
+                txn = txn.encode()
+            write(pack_length(len(txn)))
+            write(txn)
+        return
+
+    deserialize = ledger_txn_serializer.deserialize
+    serialize = serializer.serialize
+    for seqNo, txn in txns:
+        write(serialize(deserialize(txn), toBytes=True))
+        write(b'\n')
+
+
+# Storage and serializer of a --workers process
+_worker_storage = None
+_worker_serializer = None
 
 
-def make_copy_of_ledger(data_dir):
-    read_copy_data_dir = data_dir + '-read-copy'
-    if os.path.exists(read_copy_data_dir):
-        shutil.rmtree(read_copy_data_dir)
-    shutil.copytree(data_dir, read_copy_data_dir)
-    return read_copy_data_dir
+def _init_worker(ledger_data_dir, storage_name, serializer_name, storage_copies):
+    global _worker_storage, _worker_serializer
+    if storage_copies is not None:
+        # leveldb is locked by the process which opened it, every worker reads its own copy
+        ledger_data_dir = storage_copies.get()
+    _worker_storage = get_storage(storage_name, ledger_data_dir)
+    _worker_serializer = JsonSerializer() if serializer_name == 'json' else None
+
+
+def _read_chunk(seq_nos):
+    frm, to = seq_nos
+    output = io.BytesIO()
+    write_txns(_worker_storage.iterator(start=frm, end=to), _worker_serializer, output.write)
+    return output.getvalue()
+
+
+def txn_chunks(frm, to):
+    for start in range(frm, to + 1, CHUNK_TXNS):
+        yield start, min(start + CHUNK_TXNS - 1, to)
+
+
+def print_all_parallel(storage, serializer_name, output, workers, ledger_data_dir, storage_name, copy_storage):
+    """
+    Same output as print_all: the range is read in chunks by a pool of
+    processes, each with the storage open, and the chunks are written in
+    seq_no order as they complete.
+    """
+    frm = int(args.frm) if args.frm else 1
+    to = min(int(args.to), storage.size) if args.to else storage.size
+    copies = []
+    storage_copies = None
+    try:
+        if copy_storage:
+            # Copies of the snapshot, which does not change, so they are hard links only
+            storage_copies = multiprocessing.Queue()
+            for _ in range(workers):
+                copies.append(make_snapshot_of_storage(ledger_data_dir, storage_name))
+                storage_copies.put(copies[-1])
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(ledger_data_dir, storage_name, serializer_name, storage_copies)) as executor:
+            for data in bounded_map(executor, _read_chunk, txn_chunks(frm, to), workers * 2):
+                output.write(data)
+    finally:
+        for copy in copies:
+            shutil.rmtree(copy)
+
+
+def is_leveldb(storage_dir):
+    return os.path.exists(os.path.join(storage_dir, 'CURRENT'))
+
+
+def _varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip_length_prefixed(buf, pos):
+    length, pos = _varint(buf, pos)
+    return pos + length
+
+
+def read_log_records(path):
+    """
+    Records of a leveldb log file: blocks of LOG_BLOCK_SIZE bytes, each
+    record split in fragments with a crc (4), length (2) and type (1) header.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    record = b''
+    for block_start in range(0, len(data), LOG_BLOCK_SIZE):
+        block = data[block_start:block_start + LOG_BLOCK_SIZE]
+        pos = 0
+        while pos + LOG_HEADER_SIZE <= len(block):
+            length = int.from_bytes(block[pos + 4:pos + 6], 'little')
+            fragment_type = block[pos + 6]
+            if fragment_type == 0 or pos + LOG_HEADER_SIZE + length > len(block):
+                # Padding at the end of a block, or a record still being written
+                break
+            fragment = block[pos + LOG_HEADER_SIZE:pos + LOG_HEADER_SIZE + length]
+            pos += LOG_HEADER_SIZE + length
+            if fragment_type == FULL_FRAGMENT:
+                yield fragment
+            elif fragment_type == FIRST_FRAGMENT:
+                record = fragment
+            elif fragment_type == MIDDLE_FRAGMENT:
+                record += fragment
+            elif fragment_type == LAST_FRAGMENT:
+                yield record + fragment
+
+
+def live_table_numbers(manifest_path):
+    """
+    Numbers of the table files a leveldb MANIFEST refers to, from the
+    new and deleted files of its version edits.
+    """
+    live = set()
+    for record in read_log_records(manifest_path):
+        pos = 0
+        while pos < len(record):
+            tag, pos = _varint(record, pos)
+            if tag == EDIT_COMPARATOR:
+                pos = _skip_length_prefixed(record, pos)
+            elif tag in (EDIT_LOG_NUMBER, EDIT_NEXT_FILE_NUMBER, EDIT_LAST_SEQUENCE, EDIT_PREV_LOG_NUMBER):
+                _, pos = _varint(record, pos)
+            elif tag == EDIT_COMPACT_POINTER:
+                _, pos = _varint(record, pos)
+                pos = _skip_length_prefixed(record, pos)
+            elif tag == EDIT_DELETED_FILE:
+                level, pos = _varint(record, pos)
+                number, pos = _varint(record, pos)
+                live.discard((level, number))
+            elif tag == EDIT_NEW_FILE:
+                level, pos = _varint(record, pos)
+                number, pos = _varint(record, pos)
+                _, pos = _varint(record, pos)
+                pos = _skip_length_prefixed(record, pos)
+                pos = _skip_length_prefixed(record, pos)
+                live.add((level, number))
+            else:
+                raise ValueError("{}: unknown version edit tag {}".format(manifest_path, tag))
+    return {number for _, number in live}
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            raise
+        # Another file system or no hard links there
+        shutil.copy2(src, dst)
+
+
+def snapshot_storage_files(storage_dir, snapshot_dir):
+    """
+    Logs are copied before the manifest: writes the manifest already moved to
+    tables are found there, later writes missing from the copied logs are only
+    the most recent ones, so the snapshot always holds a consistent state.
+    """
+    os.makedirs(snapshot_dir)
+    for name in os.listdir(storage_dir):
+        if name in SKIPPED_FILES or name == 'CURRENT' or name.startswith('MANIFEST-') \
+                or name.endswith(TABLE_SUFFIXES):
+            continue
+        shutil.copy2(os.path.join(storage_dir, name), os.path.join(snapshot_dir, name))
+
+    with open(os.path.join(storage_dir, 'CURRENT')) as f:
+        current = f.read()
+    manifest = current.strip()
+    shutil.copy2(os.path.join(storage_dir, manifest), os.path.join(snapshot_dir, manifest))
+    with open(os.path.join(snapshot_dir, 'CURRENT'), 'w') as f:
+        f.write(current)
+
+    # Only the tables of the copied manifest are linked: their numbers are below
+    # its next file number, so leveldb never creates one of them again when it
+    # opens the snapshot, and a table still being written by the node is left out
+    for number in live_table_numbers(os.path.join(snapshot_dir, manifest)):
+        for suffix in TABLE_SUFFIXES:
+            name = '{:06d}{}'.format(number, suffix)
+            if os.path.exists(os.path.join(storage_dir, name)):
+                link_or_copy(os.path.join(storage_dir, name), os.path.join(snapshot_dir, name))
+                break
+        else:
+            raise FileNotFoundError(errno.ENOENT, "table {} of {} not found".format(number, manifest), storage_dir)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_stale_read_copies(read_copies_dir):
+    """
+    Snapshots left by killed runs: their hard links would keep
+    the compacted tables of the node on disk.
+    """
+    if not os.path.isdir(read_copies_dir):
+        return
+    for name in os.listdir(read_copies_dir):
+        # <node>-read-copy-<pid>-<random>
+        pid = name.rpartition(READ_COPY_MARK)[2].split('-')[1:2]
+        if pid and pid[0].isdigit() and not _is_running(int(pid[0])):
+            shutil.rmtree(os.path.join(read_copies_dir, name), ignore_errors=True)
+
+
+def make_snapshot_of_storage(data_dir, storage_name):
+    """
+    Snapshot of only the storage to read, in READ_COPIES_DIR: the table files
+    are hard links and only the small mutable files are copied, so it takes the
+    same time whatever the size of the ledger. The node may keep writing, the
+    snapshot is taken again if a compaction removed one of its files meanwhile.
+    """
+    storage_dir = os.path.join(data_dir, storage_name)
+    # <network>/read_copies, on the same file system as <network>/data/<node> for the hard links
+    read_copies_dir = os.path.join(os.path.dirname(os.path.dirname(data_dir)), READ_COPIES_DIR)
+    remove_stale_read_copies(read_copies_dir)
+    os.makedirs(read_copies_dir, exist_ok=True)
+    read_copy_data_dir = tempfile.mkdtemp(prefix='{}{}-{}-'.format(os.path.basename(data_dir), READ_COPY_MARK,
+                                                                  os.getpid()),
+                                          dir=read_copies_dir)
+    snapshot_dir = os.path.join(read_copy_data_dir, storage_name)
+    if not is_leveldb(storage_dir):
+        # Not a leveldb storage, a plain copy of it is all that can be done
+        shutil.copytree(storage_dir, snapshot_dir)
+        return read_copy_data_dir
+    for _ in range(SNAPSHOT_ATTEMPTS):
+        try:
+            snapshot_storage_files(storage_dir, snapshot_dir)
+            return read_copy_data_dir
+        except FileNotFoundError:
+            # A file was removed by a compaction of the node meanwhile
+            shutil.rmtree(snapshot_dir)
+    shutil.rmtree(read_copy_data_dir)
+    raise RuntimeError("{} kept changing, could not take a consistent snapshot".format(storage_dir))
 
 
 if __name__ == '__main__':
@@ -167,13 +476,16 @@ if __name__ == '__main__':
     config = getConfig()
 
     ledger_data_dir = get_ledger_dir(args.node_name, args.network)
+    storage_name = get_storage_name(args.type, ledger_data_dir)
+    if args.workers < 1:
+        print("--workers should be at least 1")
+        exit()
     read_copy_ledger_data_dir = None
     try:
         # RocksDB supports real read-only mode and does not need to have a ledger copy.
         if config.hashStore['type'].lower() != HS_ROCKSDB:
             config.db_transactions_config = None
-            # NOTE: such approach works well only for small ledgers.
-            tmp = make_copy_of_ledger(ledger_data_dir)
+            tmp = make_snapshot_of_storage(ledger_data_dir, storage_name)
 
             # Let's be paranoid to avoid removing of ledger instead of its copy.
             ledger_path = Path(ledger_data_dir)
@@ -186,8 +498,11 @@ if __name__ == '__main__':
         elif config.db_transactions_config is not None:
             # This allows to avoid debug logs creation on each read_ledger run
             config.db_transactions_config['db_log_dir'] = '/dev/null'
-        storage = get_storage(args.type, ledger_data_dir)
-        print_txns(storage, args)
+        storage = get_storage(storage_name, ledger_data_dir)
+        # leveldb locks the copy, other storages can be shared by the --workers processes
+        copy_storage = read_copy_ledger_data_dir is not None and \
+            is_leveldb(os.path.join(ledger_data_dir, storage_name))
+        print_txns(storage, args, ledger_data_dir, storage_name, copy_storage)
     finally:
         if read_copy_ledger_data_dir:
             shutil.rmtree(read_copy_ledger_data_dir)
@@ -0,0 +1,48 @@
+"""
+Seeds read from a file instead of the command line.
+
+A file holds one seed per line, either as the first column of a CSV line or
+as the "seed" field of a JSON object (JSON lines). Blank lines and lines
+starting with '#' are skipped. Seeds are read and validated lazily, so only
+as many lines as needed are read, and errors point at the line number.
+"""
+import csv
+import json
+
+SEED_LENGTH = 32
+
+
+class SeedFileError(ValueError):
+    pass
+
+
+class SeedFile:
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.json_lines = path.endswith(('.json', '.jsonl'))
+
+    def _parse(self, line, line_no):
+        if self.json_lines:
+            try:
+                seed = json.loads(line)['seed']
+            except (ValueError, KeyError, TypeError):
+                raise SeedFileError('{}:{}: expected a JSON object with a "seed" field'
+                                    .format(self.path, line_no))
+        else:
+            seed = next(csv.reader([line]))[0]
+
+        seed = str(seed).strip()
+        if len(seed) != SEED_LENGTH:
+            raise SeedFileError('{}:{}: the length of {} seed should be {} digit long'
+                                .format(self.path, line_no, self.kind, SEED_LENGTH))
+        return seed
+
+    def __iter__(self):
+        with open(self.path) as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                yield self._parse(line, line_no)
@@ -1,15 +1,50 @@
+import os
 import sys
 
 from indy_node.utils.node_runner import run_node
 from indy_common.config_util import getConfig
 
+from node_profiler import NodeProfiler
+
+
+def parse_cpu_list(cpu_list):
+    # Same format as NODE_CPU_AFFINITY in the node params file, e.g. "0-3,8"
+    cpus = set()
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def apply_cpu_affinity():
+    cpu_list = os.environ.get('NODE_CPU_AFFINITY')
+    if not cpu_list:
+        return
+    # The planned CPUs are indexes into the ones this process may use,
+    # which are not 0..n-1 in a restricted cpuset (containers, taskset)
+    allowed = sorted(os.sched_getaffinity(0))
+    cpus = {allowed[cpu % len(allowed)] for cpu in parse_cpu_list(cpu_list)}
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as exc:
+        print("Not applying NODE_CPU_AFFINITY={}: {}".format(cpu_list, exc))
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 6:
         raise Exception("Provide name and two pairs of IP/port for running the node "
                         "and client stacks in form 'node_name node_ip node_port client_ip client_port'")
 
+    apply_cpu_affinity()
     config = getConfig()
     self_name = sys.argv[1]
-    run_node(config, self_name, 
+    profiler = NodeProfiler.from_env(self_name)
+    if profiler is not None:
+        profiler.start()
+    run_node(config, self_name,
             node_ip=sys.argv[2], node_port=int(sys.argv[3]),
-            client_ip=sys.argv[4], client_port=int(sys.argv[5]))
\ No newline at end of file
+            client_ip=sys.argv[4], client_port=int(sys.argv[5]))
@@ -0,0 +1,219 @@
+"""
+Sweeps a grid of node config values against the local pool under synthetic
+load, and writes the best values back to the node config.
+
+For every combination of the grid the values are written to a marked block
+at the end of /etc/indy/indy_config.py, the local nodes are started with a
+fresh ledger from the genesis (launch_local_pool.py), and load_generator.py
+is run at each of the offered rates. Every run is appended to the results
+file, which gives the throughput/latency curve of every combination.
+The best combination is the one with the highest throughput whose p99
+latency and error rate stay within the limits.
+"""
+import argparse
+import ast
+import asyncio
+import itertools
+import json
+import shutil
+
+from indy_common.config_helper import ConfigHelper, NodeConfigHelper
+from indy_common.config_util import getConfig
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+
+from indy_network import NetworkSetup
+from launch_local_pool import LocalPool, read_pool_nodes, select_nodes
+from load_generator import LoadGenerator, _type_mix, DEFAULT_MIX
+
+INDY_CONFIG_FILE = '/etc/indy/indy_config.py'
+OVERRIDES_BEGIN = '# tune_pool.py overrides begin\n'
+OVERRIDES_END = '# tune_pool.py overrides end\n'
+
+# Used when no --param is given: 3PC batching and the client stack limits
+DEFAULT_GRID = [
+    ('Max3PCBatchSize', [100, 1000, 5000]),
+    ('Max3PCBatchWait', [0.001, 0.1, 1]),
+    ('ZMQ_CLIENT_QUEUE_SIZE', [3000, 10000]),
+    ('MAX_CONNECTED_CLIENTS_NUM', [500, 2000]),
+]
+
+
+def _type_param(value):
+    name, sep, values = value.partition('=')
+    if not sep or not name.isidentifier():
+        raise argparse.ArgumentTypeError("expected NAME=value1,value2,..., got {!r}".format(value))
+    try:
+        return name, [ast.literal_eval(v.strip()) for v in values.split(',')]
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError("{!r}: values should be python literals".format(value))
+
+
+def _type_rates(value):
+    try:
+        rates = [float(rate) for rate in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected comma separated rates, got {!r}".format(value))
+    if not rates or min(rates) <= 0:
+        raise argparse.ArgumentTypeError("rates should be > 0")
+    return rates
+
+
+def strip_overrides(contents):
+    begin = contents.find(OVERRIDES_BEGIN)
+    if begin < 0:
+        return contents
+    end = contents.find(OVERRIDES_END, begin)
+    end = len(contents) if end < 0 else end + len(OVERRIDES_END)
+    return contents[:begin] + contents[end:]
+
+
+def write_overrides(config_file, original, overrides):
+    # Later assignments win, so the block only has to come last
+    contents = strip_overrides(original)
+    if contents and not contents.endswith('\n'):
+        contents += '\n'
+    contents += OVERRIDES_BEGIN
+    for name, value in overrides:
+        contents += '{} = {!r}\n'.format(name, value)
+    contents += OVERRIDES_END
+    with open(config_file, 'w') as f:
+        f.write(contents)
+
+
+def clear_node_data(config, nodes):
+    # Nodes catch up from the genesis again, keys are kept
+    for name, *_ in nodes:
+        shutil.rmtree(NodeConfigHelper(name, config).ledger_dir, ignore_errors=True)
+
+
+def run_load(genesis_file, clients, rate, duration, mix):
+    generator = LoadGenerator(genesis_file, clients, rate, duration, mix, duration, None)
+
+    async def _run():
+        try:
+            await generator.open()
+            return await generator.run()
+        finally:
+            await generator.close()
+
+    return asyncio.get_event_loop().run_until_complete(_run())['total']
+
+
+def within_limits(total, max_p99_ms, max_error_rate):
+    answered = total['ok'] + total['errors']
+    if not total['ok'] or total['errors'] > max_error_rate * answered:
+        return False
+    return total['p99_ms'] <= max_p99_ms
+
+
+def best_trial(trials, max_p99_ms, max_error_rate):
+    good = [t for t in trials if within_limits(t['total'], max_p99_ms, max_error_rate)]
+    if not good:
+        return None
+    return max(good, key=lambda t: (t['total']['throughput'], -t['total']['p99_ms']))
+
+
+def sweep(config, config_file, original, nodes, grid, args, genesis_file, results):
+    names = [name for name, _ in grid]
+    trials = []
+    for values in itertools.product(*(values for _, values in grid)):
+        overrides = list(zip(names, values))
+        print("Trying {}".format(', '.join('{}={!r}'.format(n, v) for n, v in overrides)))
+        write_overrides(config_file, original, overrides)
+
+        for rate in args.rates:
+            if not args.keepData:
+                clear_node_data(config, nodes)
+            pool = LocalPool(config, nodes, args.logDir, args.nodeParamsFileName)
+            try:
+                pool.start()
+                if not pool.wait_ready(args.readyTimeout):
+                    print("Pool not ready, skipping rate {}".format(rate))
+                    continue
+                total = run_load(genesis_file, args.clients, rate, args.duration, args.mix)
+            finally:
+                pool.stop(args.stopTimeout)
+
+            trial = {'overrides': dict(overrides), 'rate': rate, 'total': total}
+            trials.append(trial)
+            results.write(json.dumps(trial) + '\n')
+            results.flush()
+            print("  rate {}: {:.1f} txn/s, p99 {}".format(
+                rate, total['throughput'],
+                'n/a' if total['p99_ms'] is None else '{:.1f}ms'.format(total['p99_ms'])))
+    return trials
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune node config values against the local pool under load')
+    parser.add_argument('--param', dest='params', action='append', type=_type_param,
+                        help="config value to sweep, as NAME=value1,value2,... (can be repeated, "
+                             "default: {})".format('; '.join('{}={}'.format(n, ','.join(map(str, v)))
+                                                             for n, v in DEFAULT_GRID)))
+    parser.add_argument('--rates', required=False, type=_type_rates, default=_type_rates('50,100,200'),
+                        help="offered loads in requests per second, tried for every combination (default 50,100,200)")
+    parser.add_argument('--clients', required=False, type=NetworkSetup._bootstrap_args_type_node_count, default=100,
+                        help="number of genesis clients sending requests (default 100)")
+    parser.add_argument('--duration', required=False, type=float, default=60,
+                        help="seconds of load per run (default 60)")
+    parser.add_argument('--mix', required=False, type=_type_mix, default=_type_mix(DEFAULT_MIX),
+                        help="request mix, see load_generator.py (default {})".format(DEFAULT_MIX))
+    parser.add_argument('--maxP99', required=False, type=float, default=2000,
+                        help="highest acceptable p99 latency in ms (default 2000)")
+    parser.add_argument('--maxErrorRate', required=False, type=float, default=0.01,
+                        help="highest acceptable share of failed requests (default 0.01)")
+    parser.add_argument('--results', required=False, type=str, default='tune_results.jsonl',
+                        help="file the runs are appended to as JSON lines (default tune_results.jsonl)")
+    parser.add_argument('--apply', action='store_true',
+                        help="keep the best values in the node config, otherwise it is restored")
+    parser.add_argument('--keepData', action='store_true',
+                        help="do not clear the ledgers of the local nodes before every run")
+    parser.add_argument('--configFile', required=False, type=str, default=INDY_CONFIG_FILE,
+                        help="node config file (default {})".format(INDY_CONFIG_FILE))
+    parser.add_argument('--nodeNames', nargs='+', required=False,
+                        help="nodes to start (all nodes of the pool genesis with a loopback IP by default)")
+    parser.add_argument('--nodeParamsFileName', required=False, type=str, default='indy.env',
+                        help="name of the node params files (default indy.env)")
+    parser.add_argument('--logDir', required=False, type=str, default='local_pool_logs',
+                        help="directory for the output of the nodes (default local_pool_logs)")
+    parser.add_argument('--readyTimeout', required=False, type=float, default=300,
+                        help="seconds to wait for the pool to be ready (default 300)")
+    parser.add_argument('--stopTimeout', required=False, type=float, default=30,
+                        help="seconds to wait for the nodes to exit before killing them (default 30)")
+    args = parser.parse_args()
+
+    config = getConfig()
+    genesis_file = genesis_txn_path(ConfigHelper(config).genesis_dir, NetworkSetup.pool_ledger_file_name(config))
+    try:
+        nodes = select_nodes(read_pool_nodes(genesis_file), args.nodeNames)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if not nodes:
+        parser.error("No local nodes in {}".format(genesis_file))
+
+    with open(args.configFile) as f:
+        original = f.read()
+    best = None
+    try:
+        with open(args.results, 'a') as results:
+            trials = sweep(config, args.configFile, original, nodes, args.params or DEFAULT_GRID,
+                           args, genesis_file, results)
+        best = best_trial(trials, args.maxP99, args.maxErrorRate)
+    finally:
+        if best and args.apply:
+            write_overrides(args.configFile, original, sorted(best['overrides'].items()))
+            print("Wrote the best values to {}".format(args.configFile))
+        else:
+            with open(args.configFile, 'w') as f:
+                f.write(original)
+
+    if best is None:
+        print("No run stayed within p99 <= {}ms and error rate <= {}".format(args.maxP99, args.maxErrorRate))
+    else:
+        print("Best: {} at rate {}: {:.1f} txn/s, p99 {:.1f}ms".format(
+            ', '.join('{}={!r}'.format(n, v) for n, v in sorted(best['overrides'].items())),
+            best['rate'], best['total']['throughput'], best['total']['p99_ms']))
+
+# Usages:
+# sudo python3 tune_pool.py --apply
+# sudo python3 tune_pool.py --param Max3PCBatchSize=100,1000 --param Max3PCBatchWait=0.01,0.1 --rates 100,300
@@ -0,0 +1,200 @@
+"""
+Validates the pool and domain genesis files before they are deployed.
+
+Reports in one pass: duplicate node aliases, duplicate (ip, port) pairs,
+node/client port collisions, invalid BLS proofs of possession, malformed
+keys and NODE txns not sent by a Steward of the domain genesis.
+Both files are streamed, key checks and BLS proofs run in a process pool.
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import sys
+
+import base58
+
+from indy_common.config_helper import ConfigHelper
+from indy_common.config_util import getConfig
+from plenum.bls.bls_crypto_factory import create_default_bls_crypto_factory
+from plenum.common.constants import NODE, NYM, STEWARD, ROLE, TARGET_NYM, VERKEY, DATA, ALIAS, \
+    NODE_IP, NODE_PORT, CLIENT_IP, CLIENT_PORT, BLS_KEY, BLS_KEY_PROOF
+from plenum.common.txn_util import get_type, get_payload_data, get_from
+from ledger.genesis_txn.genesis_txn_file_util import genesis_txn_path
+
+from indy_network import NetworkSetup
+from pool_map import bounded_map
+
+CHUNK_SIZE = 1000
+BLS_CHUNK_SIZE = 8
+
+
+def b58_len(value):
+    # Missing fields are None, other non-str values are just as malformed
+    if not isinstance(value, str):
+        return None
+    try:
+        return len(base58.b58decode(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def check_did(value):
+    return b58_len(value) in (16, 32)
+
+
+def check_verkey(value):
+    if value is None:
+        return True
+    if not isinstance(value, str):
+        return False
+    if value.startswith('~'):
+        return b58_len(value[1:]) == 16
+    return b58_len(value) == 32
+
+
+def _check_domain_lines(lines):
+    # Runs in worker processes: returns the problems found and the Steward nyms
+    problems = []
+    stewards = []
+    for line_no, line in lines:
+        try:
+            txn = json.loads(line)
+            if get_type(txn) != NYM:
+                continue
+            data = get_payload_data(txn)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            problems.append((line_no, "not a valid txn"))
+            continue
+        if not check_did(data.get(TARGET_NYM)):
+            problems.append((line_no, "malformed dest {}".format(data.get(TARGET_NYM))))
+        if not check_verkey(data.get(VERKEY)):
+            problems.append((line_no, "malformed verkey {}".format(data.get(VERKEY))))
+        if data.get(ROLE) == STEWARD:
+            stewards.append(data.get(TARGET_NYM))
+    return problems, stewards
+
+
+def _check_bls_proofs(nodes):
+    verifier = create_default_bls_crypto_factory().create_bls_crypto_verifier()
+    problems = []
+    for line_no, alias, blskey, key_proof in nodes:
+        try:
+            valid = verifier.verify_key_proof_of_possession(key_proof, blskey)
+        except Exception:
+            valid = False
+        if not valid:
+            problems.append((line_no, "{}: invalid BLS key proof of possession".format(alias)))
+    return problems
+
+
+def numbered_chunks(file_path):
+    with open(file_path) as f:
+        lines = ((line_no, line) for line_no, line in enumerate(f, start=1) if line.strip())
+        while True:
+            chunk = list(itertools.islice(lines, CHUNK_SIZE))
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_pool(pool_file):
+    problems = []
+    nodes = []
+    aliases = {}
+    endpoints = {}
+    nodes_by_steward = {}
+    for chunk in numbered_chunks(pool_file):
+        for line_no, line in chunk:
+            try:
+                txn = json.loads(line)
+                data = get_payload_data(txn)
+                node_data = data[DATA]
+                alias = node_data[ALIAS]
+                frm = get_from(txn)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                problems.append((line_no, "not a valid NODE txn"))
+                continue
+            if get_type(txn) != NODE:
+                problems.append((line_no, "{}: not a NODE txn".format(alias)))
+                continue
+
+            if alias in aliases:
+                problems.append((line_no, "{}: duplicate alias, first seen on line {}".format(alias, aliases[alias])))
+            aliases.setdefault(alias, line_no)
+
+            for stack, ip, port in (('node', node_data.get(NODE_IP), node_data.get(NODE_PORT)),
+                                    ('client', node_data.get(CLIENT_IP), node_data.get(CLIENT_PORT))):
+                other = endpoints.get((ip, port))
+                if other is not None:
+                    other_alias, other_stack = other
+                    kind = "port collision with the {} stack of".format(other_stack) \
+                        if other_stack != stack else "duplicate (ip, port) with"
+                    problems.append((line_no, "{}: {} stack {}:{} {} {}".format(
+                        alias, stack, ip, port, kind, other_alias)))
+                else:
+                    endpoints[(ip, port)] = (alias, stack)
+
+            if b58_len(data.get(TARGET_NYM)) != 32:
+                problems.append((line_no, "{}: malformed dest {}".format(alias, data.get(TARGET_NYM))))
+            if not b58_len(node_data.get(BLS_KEY)) or not b58_len(node_data.get(BLS_KEY_PROOF)):
+                problems.append((line_no, "{}: missing or malformed BLS key or proof".format(alias)))
+            else:
+                nodes.append((line_no, alias, node_data[BLS_KEY], node_data[BLS_KEY_PROOF]))
+
+            nodes_by_steward.setdefault(frm, []).append((line_no, alias))
+    return problems, nodes, nodes_by_steward
+
+
+def validate(pool_file, domain_file, workers):
+    problems = {pool_file: [], domain_file: []}
+
+    pool_problems, nodes, nodes_by_steward = read_pool(pool_file)
+    problems[pool_file] += pool_problems
+
+    stewards = set()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        bls_chunks = [nodes[i:i + BLS_CHUNK_SIZE] for i in range(0, len(nodes), BLS_CHUNK_SIZE)]
+        bls_results = [executor.submit(_check_bls_proofs, chunk) for chunk in bls_chunks]
+        for domain_problems, chunk_stewards in bounded_map(executor, _check_domain_lines,
+                                                           numbered_chunks(domain_file), workers * 2):
+            problems[domain_file] += domain_problems
+            stewards.update(chunk_stewards)
+        for bls_result in bls_results:
+            problems[pool_file] += bls_result.result()
+
+    for steward, steward_nodes in nodes_by_steward.items():
+        if steward not in stewards:
+            for line_no, alias in steward_nodes:
+                problems[pool_file].append((line_no, "{}: sent by {} which is not a Steward".format(alias, steward)))
+        if len(steward_nodes) > 1:
+            for line_no, alias in steward_nodes[1:]:
+                problems[pool_file].append((line_no, "{}: Steward {} already has node {}".format(
+                    alias, steward, steward_nodes[0][1])))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Validate pool and domain genesis files')
+    parser.add_argument('--network', required=False, type=str, help="Network to validate")
+    parser.add_argument('--genesis_dir', required=False, type=str,
+                        help="Directory with the genesis files (network genesis dir by default)")
+    parser.add_argument('--workers', required=False, type=NetworkSetup._bootstrap_args_type_workers, default='0',
+                        help="worker processes, 0 means one per CPU (default 0)")
+    args = parser.parse_args()
+
+    config = getConfig()
+    if args.network:
+        config.NETWORK_NAME = args.network
+    genesis_dir = args.genesis_dir or ConfigHelper(config).genesis_dir
+    pool_file = genesis_txn_path(genesis_dir, NetworkSetup.pool_ledger_file_name(config))
+    domain_file = genesis_txn_path(genesis_dir, NetworkSetup.domain_ledger_file_name(config))
+
+    problems = validate(pool_file, domain_file, args.workers)
+    for file_path, file_problems in problems.items():
+        for line_no, problem in sorted(file_problems):
+            print("{}:{}: {}".format(file_path, line_no, problem))
+    sys.exit(1 if any(problems.values()) else 0)
+
+# Usages:
+# python3 validate_genesis.py --network sandbox
@@ -0,0 +1,94 @@
+"""
+Verifies genesis files against the manifest NetworkSetup writes next to them.
+
+Files whose size and mtime (to the second) still match the manifest are unchanged
+without being read, other files are re-hashed. With --reference the checked
+manifest is also compared to the one produced on the generating host.
+"""
+import argparse
+import json
+import os
+import sys
+
+from indy_common.config_helper import ConfigHelper
+from indy_common.config_util import getConfig
+
+from indy_network import NetworkSetup, GENESIS_MANIFEST_FILE
+
+# mtimes are compared in whole seconds, the precision that survives tar
+# (integer seconds in GNU headers, a float in PAX headers)
+MTIME_PRECISION_NS = 10 ** 9
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def verify_files(genesis_dir, manifest, full=False):
+    problems = []
+    for file_name, entry in sorted(manifest.items()):
+        file_path = os.path.join(genesis_dir, file_name)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            problems.append("{}: missing".format(file_name))
+            continue
+
+        if not full and st.st_size == entry['size'] and \
+                st.st_mtime_ns // MTIME_PRECISION_NS == entry['mtime_ns'] // MTIME_PRECISION_NS:
+            print("{}: unchanged".format(file_name))
+            continue
+
+        if NetworkSetup.file_sha256(file_path) != entry['sha256']:
+            problems.append("{}: SHA-256 differs from the manifest".format(file_name))
+        else:
+            print("{}: content matches".format(file_name))
+    return problems
+
+
+def compare_manifests(manifest, reference):
+    problems = []
+    for file_name, ref_entry in sorted(reference.items()):
+        entry = manifest.get(file_name)
+        if entry is None:
+            problems.append("{}: not in the manifest".format(file_name))
+            continue
+        for field in ('txn_count', 'root_hash', 'sha256'):
+            if entry[field] != ref_entry[field]:
+                problems.append("{}: {} is {}, expected {}".format(file_name, field, entry[field], ref_entry[field]))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verify genesis files against their manifest')
+    parser.add_argument('--network', required=False, type=str, help="Network to verify")
+    parser.add_argument('--genesis_dir', required=False, type=str,
+                        help="Directory with the genesis files (network genesis dir by default)")
+    parser.add_argument('--manifest', required=False, type=str,
+                        help="Manifest to verify against ({} in the genesis dir by default)"
+                        .format(GENESIS_MANIFEST_FILE))
+    parser.add_argument('--reference', required=False, type=str,
+                        help="Manifest from the generating host to compare with")
+    parser.add_argument('--full', required=False, action='store_true',
+                        help="re-hash the files even if they look unchanged")
+    args = parser.parse_args()
+
+    genesis_dir = args.genesis_dir
+    if not genesis_dir:
+        config = getConfig()
+        if args.network:
+            config.NETWORK_NAME = args.network
+        genesis_dir = ConfigHelper(config).genesis_dir
+
+    manifest = load_manifest(args.manifest or os.path.join(genesis_dir, GENESIS_MANIFEST_FILE))
+    problems = verify_files(genesis_dir, manifest, args.full)
+    if args.reference:
+        problems += compare_manifests(manifest, load_manifest(args.reference))
+
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+# Usages:
+# python3 verify_genesis.py --network sandbox --reference /tmp/genesis_manifest.json